@@ -7,6 +7,7 @@
 入口脚本
 '''
 import os
+import sys
 from context import vehiclesContext
 from vehicles import Vehicles
 
@@ -14,9 +15,9 @@ excel_files_test = ['test_files/12月货车_测试.xlsx', 'test_files/12月客
 excel_files = ['test_files/12月货车.xlsx', 'test_files/12月客车.xlsx']
 
 
-def get_files():
-    root = 'test_files/leshanbei_xls_fast'
-    root = 'test_files/maoqiao01'
+def get_files(root='test_files/maoqiao01'):
+    '''root文件夹（含子文件夹）下的所有文件
+    '''
     list_of_files = []
     for root, dirs, files in os.walk(root):
         for f in files:
@@ -24,15 +25,19 @@ def get_files():
     return list_of_files
 
 
-def main():
+def main(profile='archive'):
+    '''profile:图片输出配置，'draft'草稿，'print'打印，'archive'存档（最清晰）
+    '''
     print('读取数据和绘制图片时，内存占用较大，建议使用前关闭计算机上其他不必要的程序。')
     print('开始读取数据...')
-    vehicles = Vehicles(get_files())
+    vehicles = Vehicles(get_files(), workers=os.cpu_count(),
+                        render_workers=os.cpu_count())
     print(f'共读取数据{vehicles.nrows_read}条，用时{vehicles.time_spent}秒')
     print(f'开始绘制图片，并生成Word文件...')
-    outputfile = vehiclesContext(vehicles).rend()
+    outputfile = vehiclesContext(vehicles, profile=profile).rend()
     print(f'生成成功：{outputfile}')
 
 
 if __name__ == '__main__':
-    main()
+    # 用法：python app.py [draft|print|archive]
+    main(*sys.argv[1:2])
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# batch.py
+# Author: Claudio <3261958605@qq.com>
+# Created: 2026-10-17 21:45:30
+# Code:
+'''
+批量生成多个收费站、多个时期的报告
+'''
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
+import pandas as pd
+import draw
+from app import get_files
+from context import vehiclesContext
+from filepath import filePath as fp
+from vehicles import Vehicles
+
+# 工作进程中共享的Word模板文件内容，见_setup_worker
+_template = None
+
+
+def _setup_worker(template):
+    '''工作进程的初始化函数，每个进程只执行一次
+    保存模板文件内容，导入matplotlib并设置绘图参数，之后的任务直接使用
+    jinja2环境在context导入时创建，同一进程中的任务共用
+    '''
+    global _template
+    _template = template
+    draw.setup('Agg')
+
+
+def run_job(folder, period=None, profile='archive', template=None):
+    '''生成一份报告
+    folder:收费站数据文件夹，读取其中（含子文件夹）所有文件
+    period:只统计该时期的数据，如'2021-12'，默认统计所有数据
+    profile:图片输出配置，见draw.Draw.PROFILES
+    template:Word模板文件内容(bytes)，默认使用工作进程共享的模板
+    返回dict{任务信息, 报告文件, 行数, 用时, 错误}
+    '''
+    summary = {'folder': folder, 'period': period, 'station': None,
+               'report': None, 'nrows_read': 0, 'nrows': 0,
+               'nrows_duplicate': 0,
+               'time_read': None, 'time_spent': None, 'error': None}
+    begin = timer()
+    try:
+        excel_files = get_files(folder)
+        if not excel_files:
+            raise FileNotFoundError(f'{folder}中没有数据文件')
+        vehicles = Vehicles(excel_files, period=period,
+                            render_profile=profile)
+        summary.update(station=vehicles.station,
+                       nrows_read=vehicles.nrows_read,
+                       nrows=vehicles.frame.shape[0],
+                       nrows_duplicate=sum(vehicles.duplicate_rows.values()),
+                       time_read=vehicles.time_spent)
+        context = vehiclesContext(vehicles, template=template or _template)
+        # 指定时期时报告文件名以时期开头，同一收费站不同时期的报告不会相互覆盖
+        summary['report'] = context.rend(period)
+    except Exception as e:
+        # 单个任务出错不影响其他任务，记录在汇总中
+        summary['error'] = f'{type(e).__name__}: {e}'
+        print(f'{folder} {period}：生成失败，{summary["error"]}')
+    summary['time_spent'] = round(timer()-begin, 2)
+    return summary
+
+
+def read_jobs(manifest):
+    '''读取任务清单
+    manifest:csv文件，每行一个任务，列为folder（数据文件夹）和period（时期，可为空）
+    返回[(folder, period)]
+    '''
+    jobs = pd.read_csv(manifest, dtype=str, encoding='utf-8-sig')
+    if 'period' not in jobs.columns:
+        jobs['period'] = None
+    jobs = jobs.astype(object).where(jobs.notna(), None)
+    return list(jobs[['folder', 'period']].itertuples(index=False, name=None))
+
+
+def run_batch(jobs, workers=1, profile='archive', template='template.docx',
+              max_tasks_per_child=4, summary_file='batch_summary.csv'):
+    '''批量生成报告
+    jobs:[(folder, period)]，见read_jobs
+    workers:工作进程数，每个进程一次生成一份报告，<=1时在当前进程中依次生成
+    template:Word模板文件名，只读取一次，各任务共用
+    max_tasks_per_child:每个工作进程最多完成的任务数，之后由新进程替换，
+                        释放各任务累积的内存，限制内存占用，需要Python 3.11
+    summary_file:汇总文件名，保存在reports文件夹，每个任务一行
+    返回汇总DataFrame
+    '''
+    with open(fp(template).as_template_file, 'rb') as f:
+        template = f.read()
+    begin = timer()
+    if workers <= 1:
+        _setup_worker(template)
+        summaries = [run_job(folder, period, profile)
+                     for folder, period in jobs]
+    else:
+        # max_tasks_per_child需要Python 3.11，且不能与fork启动方式同时使用
+        # 更早的版本中工作进程不替换，内存占用随任务数增长
+        options = {}
+        if sys.version_info >= (3, 11):
+            options['max_tasks_per_child'] = max_tasks_per_child
+        else:
+            print('注意：Python 3.11以下不支持max_tasks_per_child，工作进程不会替换')
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_setup_worker, initargs=(template,),
+                **options) as executor:
+            futures = [executor.submit(run_job, folder, period, profile)
+                       for folder, period in jobs]
+            summaries = [future.result() for future in futures]
+    summary = pd.DataFrame(summaries)
+    summary.to_csv(fp(summary_file).as_report_file, index=False,
+                   encoding='utf-8-sig')
+    failed = summary['error'].notna().sum()
+    print(f'共{len(summary)}个任务，失败{failed}个，'
+          f'用时{round(timer()-begin, 2)}秒')
+    return summary
+
+
+if __name__ == '__main__':
+    # 用法：python batch.py 任务清单.csv [进程数] [draft|print|archive]
+    manifest = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    run_batch(read_jobs(manifest), workers, *sys.argv[3:4])
@@ -0,0 +1,417 @@
+#!/usr/bin/python3
+# benchmark.py
+# Author: Claudio <3261958605@qq.com>
+# Created: 2026-10-17 11:20:08
+# Code:
+'''
+性能测试，用合成数据比较新旧实现的耗时
+用法：python benchmark.py [测试名称...]，不指定名称时运行所有测试
+'''
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from timeit import default_timer as timer
+
+
+def timed(func, *args, repeat=3):
+    '运行repeat次，返回最短耗时（秒）和最后一次的结果'
+    best, result = None, None
+    for i in range(repeat):
+        begin = timer()
+        result = func(*args)
+        spent = timer() - begin
+        best = spent if best is None else min(best, spent)
+    return best, result
+
+
+def synthetic_modes(nrows=1000000, seed=0):
+    '合成mode和axis两列，车型和轴数分布与实际数据相近'
+    rng = np.random.default_rng(seed)
+    modes = np.array([1, 2, 3, 4, 11, 12, 13, 14, 15, 16, 21, 22, 23, 24, 25, 26])
+    return pd.DataFrame({
+        'mode': rng.choice(modes, nrows),
+        'axis': rng.choice([2, 3, 4, 5, 6], nrows)})
+
+
+def legacy_normalize_mode(frame):
+    '改为向量化之前的Vehicles._normalize_mode'
+    frame['mode'] = frame['mode'].apply(
+        lambda m: m-10 if m >= 21 else m)
+    frame['mode'] = frame[['axis', 'mode']].apply(
+        lambda x: 16 if x['axis'] == 6 else x['mode'], axis='columns')
+    frame.drop('axis', axis='columns', inplace=True)
+
+
+def bench_normalize_mode(nrows=1000000):
+    '车型调整：逐行apply与MODE_RULES向量化实现比较'
+    from vehicles import Vehicles
+    frame = synthetic_modes(nrows)
+
+    def run(normalize):
+        df = frame.copy()
+        normalize(df)
+        return df['mode'].astype(np.uint8)
+
+    legacy, expected = timed(run, legacy_normalize_mode, repeat=1)
+    vectorized, result = timed(run, Vehicles._normalize_mode)
+    assert result.equals(expected), '向量化结果与原实现不一致'
+    print(f'normalize_mode {nrows}行：apply {legacy:.3f}秒，'
+          f'向量化 {vectorized:.4f}秒，加速{legacy/vectorized:.0f}倍')
+
+
+def synthetic_figures(seed=0):
+    '合成一份报告中各类图片的数据，返回[(Draw方法名, df)]'
+    rng = np.random.default_rng(seed)
+
+    def fees(n):
+        return np.round(rng.uniform(1, 100, n), 2)
+
+    def pers(n):
+        per = rng.uniform(1, 10, n)
+        return np.round(per / per.sum() * 100, 2)
+
+    modes = ['一客', '二客', '三客', '四客', '一货', '二货', '三货', '六货']
+    provinces = ['云南', '贵州', '重庆', '陕西', '甘肃', '湖北', '湖南']
+    stations = [f'四川收费站{i}' for i in range(20)]
+    plates = [f'川A{i:05d}' for i in range(30)]
+    return [
+        ('for_all_modes', pd.DataFrame({'mode': modes, 'fee': fees(8)})),
+        ('for_cars_and_trucks', pd.DataFrame({'mode': modes[:4],
+                                              'fee': fees(4)})),
+        ('for_in_vs_out', pd.DataFrame({'province': ['省内', '省外'],
+                                        'per': [70.0, 30.0]})),
+        ('for_primary', pd.DataFrame({'province': provinces,
+                                      'fee': fees(7), 'per': pers(7)})),
+        ('for_primary', pd.DataFrame({'station': stations[:4],
+                                      'fee': fees(4), 'per': pers(4) * 0.6})),
+        ('for_primary', pd.DataFrame({'station': stations,
+                                      'fee': fees(20), 'per': pers(20)})),
+        ('for_topmost_plates', pd.DataFrame({'plate': plates, 'fee': fees(30),
+                                             'count': rng.integers(1, 99, 30)})),
+    ]
+
+
+def peak_rss():
+    '当前进程的峰值内存，单位MB，不支持时返回None'
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def figure_memory_rounds(pyplot, rounds=6, profile='print'):
+    '''在当前进程中重复绘制报告中的所有图片rounds次，峰值内存不应随次数增长
+    pyplot:见draw.Draw，True为pyplot，False为Figure/Agg
+    ru_maxrss为整个进程的峰值，每种方式应在单独的进程中运行，见bench_figure_memory
+    '''
+    from draw import Draw
+    name = 'pyplot' if pyplot else 'Figure/Agg'
+    figures = synthetic_figures()
+    peaks = []
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(rounds):
+            begin = timer()
+            for j, (kind, df) in enumerate(figures):
+                fig_path = os.path.join(folder, f'{j}.png')
+                draw = Draw(df, fig_path, pyplot=pyplot, profile=profile)
+                getattr(draw, kind)()
+            peaks.append(peak_rss())
+            print(f'figure_memory {name} 第{i+1}次：{len(figures)}张图片，'
+                  f'{timer()-begin:.2f}秒，峰值内存{peaks[-1]:.0f}MB')
+    # 前两次包含字体缓存等一次性开销，从第三次开始比较
+    growth = peaks[-1] - peaks[2]
+    print(f'figure_memory {name} 第3次至第{rounds}次'
+          f'峰值内存增长{growth:.0f}MB')
+    # 内存分配器偶尔整块增长，泄漏时每次都增长约一张画布的大小
+    assert growth <= max(30, peaks[2] * 0.15), \
+        f'{name}绘图后峰值内存持续增长'
+
+
+def bench_figure_memory(rounds=6, profile='print'):
+    '''重复绘制报告中的所有图片，峰值内存不应随次数增长
+    pyplot和Figure/Agg两种方式各在一个新进程中运行rounds次，
+    否则后运行的方式的峰值被先运行的方式的峰值掩盖
+    profile:为缩短运行时间使用300dpi的'print'，图片越大泄漏越明显
+    '''
+    if peak_rss() is None:
+        print('figure_memory：当前系统不支持获取峰值内存，跳过')
+        return
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here)
+    for pyplot in (True, False):
+        code = ('import benchmark; '
+                f'benchmark.figure_memory_rounds({pyplot}, {rounds}, {profile!r})')
+        result = subprocess.run([sys.executable, '-c', code], env=env)
+        assert result.returncode == 0, \
+            f'figure_memory pyplot={pyplot}失败，见上面的输出'
+
+
+def bench_import(repeat=3):
+    '''在新进程中导入vehicles的耗时，只读取数据时不应导入matplotlib
+    改为第一次绘图时导入前约1.1-1.4秒，之后约0.6秒
+    '''
+    code = ('import sys, timeit; begin = timeit.default_timer(); '
+            'import vehicles; '
+            'print(timeit.default_timer() - begin, "matplotlib" in sys.modules)')
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here)
+    spent = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], env=env,
+                                capture_output=True, text=True,
+                                check=True).stdout.split()
+        spent.append(float(output[0]))
+        assert output[1] == 'False', '导入vehicles时导入了matplotlib'
+    print(f'import vehicles：{min(spent):.3f}秒，未导入matplotlib')
+
+
+def bench_barplot(repeat=5):
+    '''柱状图：sns.barplot与直接用ax.bar绘制比较
+    两种方式绘制的图片应逐像素相同，耗时不包括栅格化和保存图片
+    '''
+    import draw
+    from draw import Draw
+    draw.setup()
+    if not draw.direct_barplot:
+        print('barplot 已安装的seaborn>=0.13，两种方式都使用sns.barplot，无需比较')
+        return
+
+    def draw_all(backend):
+        images, spent = [], []
+
+        def capture(fig):
+            begin = timer()
+            fig.canvas.draw()
+            images.append(np.asarray(fig.canvas.buffer_rgba()).copy())
+            spent.append(timer() - begin)
+
+        begin = timer()
+        for kind, df in synthetic_figures():
+            draw = Draw(df, None, pyplot=False, backend=backend)
+            draw._save = capture
+            getattr(draw, kind)()
+        return timer() - begin - sum(spent), images
+
+    def best(backend):
+        results = [draw_all(backend) for i in range(repeat)]
+        return min(r[0] for r in results), results[-1][1]
+
+    seaborn, expected = best('seaborn')
+    direct, result = best('matplotlib')
+    assert len(result) == len(expected)
+    for i, (a, b) in enumerate(zip(expected, result)):
+        assert a.shape == b.shape and (a == b).all(), f'第{i+1}张图片不一致'
+    print(f'barplot {len(expected)}张图片逐像素相同：seaborn {seaborn:.3f}秒，'
+          f'matplotlib {direct:.3f}秒，加速{seaborn/direct:.1f}倍')
+
+
+def synthetic_files(nfiles=10, nrows=200000, overlap=0.1, seed=0):
+    '''合成nfiles个文件清理后的frame，列和类型同Vehicles.SCHEMA
+    每个文件的category列只含本文件出现的类别，
+    每个文件的前overlap比例的行与上一个文件重复，模拟同一日重复导出
+    '''
+    rng = np.random.default_rng(seed)
+    plates = np.array([f'川A{i:05d}' for i in range(nrows)])
+    stations = np.array([f'四川收费站{i}' for i in range(2000)])
+    begin = np.datetime64('2021-12-01', 's')
+    frames, previous = [], None
+    for i in range(nfiles):
+        frame = pd.DataFrame({
+            'plate': rng.choice(plates, nrows),
+            'datetime': begin + rng.integers(0, 86400*31, nrows),
+            'station': rng.choice(stations, nrows),
+            'mode': rng.choice([1, 2, 11, 12, 16], nrows).astype(np.uint8),
+            'fee': rng.integers(100, 50000, nrows),
+            'province': np.zeros(nrows, np.uint8)})
+        if previous is not None:
+            n = int(nrows*overlap)
+            frame.iloc[:n] = previous.iloc[-n:].to_numpy()
+        previous = frame
+        frames.append(frame.astype({'plate': 'category', 'station': 'category',
+                                    'mode': np.uint8, 'fee': np.int64,
+                                    'province': np.uint8,
+                                    'datetime': 'datetime64[s]'}))
+    return frames
+
+
+def bench_dedupe(nfiles=10, nrows=200000):
+    '''去除重复行：合并后的frame上DataFrame.duplicated与按指纹判断
+    (Vehicles.duplicated)比较，再统计Vehicles.dedupe每个文件中被去除的行数
+    '''
+    from vehicles import Vehicles
+    frames = synthetic_files(nfiles, nrows)
+    frame = Vehicles.concat_frames(frames)
+
+    old, expected = timed(frame.duplicated)
+    new, result = timed(Vehicles.duplicated, frame)
+    assert (result == expected.to_numpy()).all(), '与DataFrame.duplicated不一致'
+    merged, counts = Vehicles.dedupe(frames)
+    assert merged.equals(frame.drop_duplicates(ignore_index=True))
+    assert counts[0] == 0 and (counts[1:] == int(nrows*0.1)).all()
+    print(f'dedupe {nfiles}个文件共{nfiles*nrows}行，重复{counts.sum()}行：'
+          f'duplicated {old:.3f}秒，指纹 {new:.3f}秒，加速{old/new:.1f}倍')
+
+
+def legacy_normalize_per(per_col):
+    '改为最大余数法之前的Vehicles.normalize_per，差值全部由最大值承担'
+    from decimal import Decimal
+    from d import D
+    idx_max = per_col.argmax()
+    value_max = per_col[idx_max]
+    per_col = per_col.copy().astype(np.str_)
+    diff = D.minus(D(per_col).sum(), 100)
+    if diff == Decimal('0'):
+        return per_col.map(lambda p: float(Decimal(p)))
+    per_col[idx_max] = str(D.minus(value_max, diff))
+    return per_col.map(float)
+
+
+def bench_normalize_per(ngroups=200000, seed=0):
+    '''百分比正常化：原实现（字符串+decimal）与最大余数法比较
+    分组数与按车牌分组相近，新结果之和应精确为100，且每项与未舍入的百分比相差<0.01
+    '''
+    from d import D
+    from vehicles import Vehicles
+    rng = np.random.default_rng(seed)
+    fens = rng.integers(100, 500000, ngroups)
+    total = int(fens.sum())
+    per = pd.Series(D.fen_per(fens, total))
+
+    legacy, expected = timed(legacy_normalize_per, per, repeat=1)
+    hamilton, result = timed(Vehicles.normalize_per, fens)
+    assert np.rint(result*100).astype(np.int64).sum() == 10000
+    assert (np.abs(result - fens*100/total) < 0.01).all()
+    worst = np.abs(expected.to_numpy() - fens*100/total).max()
+    print(f'normalize_per {ngroups}组：原实现 {legacy:.3f}秒（最大误差{worst:.2f}），'
+          f'最大余数法 {hamilton:.4f}秒，加速{legacy/hamilton:.0f}倍')
+
+
+def legacy_get_primary_rows(frame, key='per', pct=60, max_len=30, by='fen'):
+    '''改为部分排序之前的Vehicles.get_primary_rows，全部排序后累加
+    原实现按key（四舍五入后的百分比）用默认的快速排序，值相同的行顺序不确定，
+    这里改为按by（各组通行费，分）稳定排序，作为比较的标准
+    '''
+    sorted_df = frame.sort_values(by=by, ascending=False, ignore_index=True,
+                                  kind='stable')
+    if frame.shape[0] <= max_len:
+        return sorted_df
+    cumsum_col = sorted_df[key].cumsum()
+    bigger_idx = cumsum_col.loc[cumsum_col >= pct].index[0]
+    if bigger_idx + 1 > max_len:
+        return sorted_df.iloc[:max_len]
+    return sorted_df.iloc[:bigger_idx+1]
+
+
+def bench_primary_rows(ngroups=(1000, 10000, 200000), seed=0):
+    '''主要部分：全部排序后累加与argpartition部分排序(Vehicles.select_top)比较
+    分组数分别与收费站，车牌相近，per由normalize_per得出，有大量相同的值，
+    两种方式都按通行费(fen)排序，截取的行应相同，且不因per相同而丢弃通行费多的行
+    '''
+    from vehicles import Vehicles
+    rng = np.random.default_rng(seed)
+    for n in ngroups:
+        fens = (rng.pareto(1.5, n) * 10000 + 100).astype(np.int64)
+        frame = pd.DataFrame({'station': np.arange(n),
+                              'per': Vehicles.normalize_per(fens),
+                              'fen': fens})
+        for pct, max_len in ((60, 30), (80, 30), (60, 1000)):
+            def run(get_primary_rows):
+                return get_primary_rows(frame, 'per', pct, max_len, by='fen')
+            legacy, expected = timed(run, legacy_get_primary_rows)
+            partial, result = timed(run, Vehicles.get_primary_rows)
+            assert result.equals(expected.reset_index(drop=True)), \
+                f'{n}组，pct={pct}，max_len={max_len}时结果不一致'
+            dropped = np.setdiff1d(np.arange(n), result['station'].to_numpy())
+            assert fens[dropped].max(initial=0) <= result['fen'].min(), \
+                f'{n}组，pct={pct}，max_len={max_len}时丢弃了通行费更多的行'
+            print(f'primary_rows {n}组 pct={pct} max_len={max_len}，'
+                  f'选取{result.shape[0]}行：全部排序 {legacy*1000:.2f}毫秒，'
+                  f'部分排序 {partial*1000:.2f}毫秒，加速{legacy/partial:.1f}倍')
+
+
+def synthetic_workbook(path, nrows=3000, dimension=None, seed=0):
+    '''合成一个与导出文件格式相同的xlsx文件，前3行为标题，第4行为表头
+    dimension:改写文件中记录的范围(<dimension>)，如'A1:I100'，模拟记录有误的文件
+    '''
+    import re
+    import zipfile
+    from openpyxl import Workbook
+    rng = np.random.default_rng(seed)
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['标题'])
+    sheet.append([])
+    sheet.append(['说明'])
+    sheet.append(['出口高速', '出口站名', '出口车牌号', '出口时间', '入口站名',
+                  '出口车型', '通行费金额', '车辆总轴数'])
+    stations = ['云南新区', '贵州东', '陕西中心', '四川乐山', None]
+    begin = np.datetime64('2021-12-01', 's')
+    for i in range(nrows):
+        sheet.append(['乐宜高速', '乐宜乐山北', f'川A{rng.integers(100000):05d}',
+                      str(begin + int(rng.integers(86400*3))).replace('T', ' '),
+                      stations[rng.integers(len(stations))],
+                      int(rng.choice([1, 2, 11, 12, 16])),
+                      f'{rng.integers(100, 80000)/100:.2f}',
+                      int(rng.integers(2, 7))])
+    workbook.save(path)
+    if dimension:
+        tmp_path = path + '.tmp'
+        with zipfile.ZipFile(path) as source, \
+                zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                data = source.read(item.filename)
+                if item.filename.startswith('xl/worksheets/sheet'):
+                    data = re.sub(rb'<dimension ref="[^"]*"/>',
+                                  f'<dimension ref="{dimension}"/>'.encode(),
+                                  data)
+                target.writestr(item, data)
+        os.replace(tmp_path, path)
+
+
+def bench_reader(nrows=3000):
+    '''读取xlsx：StreamReader分块读取与pandas.read_excel比较
+    文件中记录的范围(<dimension>)有误时，两种方式读取的行仍应相同
+    '''
+    from cache import FrameCache
+    from vehicles import Vehicles
+    with tempfile.TemporaryDirectory() as folder:
+        for dimension in (None, 'A1:I100', 'A1:C5'):
+            path = os.path.join(folder, f'{dimension or "ok"}.xlsx'.replace(':', '_'))
+            synthetic_workbook(path, nrows, dimension)
+            results = {}
+            for reader in ('pandas', 'stream'):
+                spent, packed = timed(Vehicles._load_excel_packed, path, reader,
+                                      repeat=1)
+                frames, meta = FrameCache.unpack(packed)
+                results[reader] = spent, frames, meta
+            (old, expected, expected_meta), (new, frames, meta) = \
+                results['pandas'], results['stream']
+            assert meta == expected_meta, f'记录的范围为{dimension}时行数不一致'
+            for name, frame in frames.items():
+                assert frame.equals(expected[name]), \
+                    f'记录的范围为{dimension}时{name}不一致'
+            print(f'reader {meta["nrows"]}行，记录的范围{dimension or "正确"}：'
+                  f'pandas {old:.3f}秒，stream {new:.3f}秒，结果相同')
+
+
+BENCHMARKS = {
+    'normalize_mode': bench_normalize_mode,
+    'figure_memory': bench_figure_memory,
+    'import': bench_import,
+    'barplot': bench_barplot,
+    'dedupe': bench_dedupe,
+    'normalize_per': bench_normalize_per,
+    'primary_rows': bench_primary_rows,
+    'reader': bench_reader,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
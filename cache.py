@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+# cache.py
+# Author: Claudio <3261958605@qq.com>
+# Created: 2026-10-17 09:12:40
+# Code:
+'''
+缓存单个Excel文件清理后的数据，避免每次运行都重新解析Excel
+缓存绘制的图片，数据未改变时不重新绘图
+'''
+import hashlib
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from filepath import filePath as fp
+
+
+class FrameCache:
+    '''
+    以numpy的npz文件按列缓存DataFrame
+功能：
+1.每个Excel文件对应一个缓存文件，文件名由Excel文件的绝对路径得出
+2.缓存键为Excel文件的路径，大小，修改时间和内容哈希值，任何一项不同则该文件缓存失效
+3.字符串列按字典编码保存（整数编码+字符串表），datetime列保存为int64
+4.pack/unpack将DataFrame与dict{名称:numpy数组}相互转换，
+  也用于多进程读取时在进程间传递数据
+
+VERSION:清理流程或数据类型改变时加1，使所有旧缓存失效
+'''
+    VERSION = 5
+    META_KEY = '__meta__'
+    FINGERPRINT_KEY = '__fingerprint__'
+
+    def __init__(self, folder=None):
+        '''folder:缓存文件夹，默认为当前文件夹下的cache
+        '''
+        self.folder = folder or fp.make_dir('cache')
+
+    @classmethod
+    def fingerprint(cls, excel_file):
+        '获取文件的路径，大小，修改时间和内容哈希值'
+        path = os.path.abspath(excel_file)
+        stat = os.stat(path)
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return {'version': cls.VERSION,
+                'path': path,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'sha1': sha1.hexdigest()}
+
+    def cache_file(self, excel_file):
+        '获取excel_file对应的缓存文件路径'
+        path = os.path.abspath(excel_file)
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, f'{name}.npz')
+
+    def load(self, excel_file):
+        '''读取excel_file的缓存，返回pack()得到的dict
+        缓存不存在或已失效时返回None
+        '''
+        cache_file = self.cache_file(excel_file)
+        if not os.path.exists(cache_file):
+            return None
+        with np.load(cache_file, allow_pickle=False) as data:
+            fingerprint = json.loads(str(data[self.FINGERPRINT_KEY]))
+            if fingerprint != self.fingerprint(excel_file):
+                return None
+            return {key: data[key] for key in data.files
+                    if key != self.FINGERPRINT_KEY}
+
+    def save(self, excel_file, packed):
+        '''保存excel_file清理后的数据
+        packed:pack()得到的dict
+        '''
+        arrays = dict(packed)
+        arrays[self.FINGERPRINT_KEY] = np.array(
+            json.dumps(self.fingerprint(excel_file)))
+
+        # 先写入临时文件再替换，避免中断后留下损坏的缓存
+        # 临时文件名含进程号，多个进程（如batch.py的任务）同时缓存同一文件时互不影响
+        cache_file = self.cache_file(excel_file)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **arrays)
+        try:
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            # 替换失败（如Windows上其他进程正在读取）时，缓存由其他进程写入，
+            # 内容相同，无需报错；缓存只用于加速，未写入也不影响结果
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            if not os.path.exists(cache_file):
+                print(f'注意：{excel_file}的缓存未能保存')
+
+    @classmethod
+    def pack(cls, frames, meta=None):
+        '''将多个DataFrame按列转换为dict{名称:numpy数组}
+        frames:dict{名称:DataFrame}
+        meta:可转换为json的其他数据，如行数
+        '''
+        arrays = {}
+        columns = {}
+        for name, frame in frames.items():
+            columns[name] = cls._encode(frame, name, arrays)
+        arrays[cls.META_KEY] = np.array(json.dumps({
+            'frames': columns,
+            'meta': meta or {}}))
+        return arrays
+
+    @classmethod
+    def unpack(cls, arrays, names=None):
+        '''pack()的逆操作
+        names:只还原其中的DataFrame，默认全部还原
+              arrays为np.load()的结果时，未还原的数组不会从文件读取
+        返回(frames, meta)，frames为dict{名称:DataFrame}
+        '''
+        meta = json.loads(str(arrays[cls.META_KEY]))
+        frames = {name: cls._decode(arrays, name, columns)
+                  for name, columns in meta['frames'].items()
+                  if names is None or name in names}
+        return frames, meta['meta']
+
+    @classmethod
+    def _encode(cls, frame, name, arrays):
+        '''将frame的各列写入arrays，返回各列的[列名，编码方式]
+        '''
+        columns = []
+        for col in frame.columns:
+            series = frame[col]
+            key = f'{name}/{col}'
+            if pd.api.types.is_datetime64_any_dtype(series):
+                kind = str(series.dtype)
+                arrays[key] = series.to_numpy().view(np.int64)
+            elif series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype):
+                kind = 'category' if isinstance(
+                    series.dtype, pd.CategoricalDtype) else 'object'
+                cat = pd.Categorical(series)
+                arrays[key] = cat.codes
+                arrays[key + '/categories'] = np.array(
+                    cat.categories.to_numpy(), dtype=np.str_)
+            else:
+                kind = 'values'
+                arrays[key] = series.to_numpy()
+            columns.append([col, kind])
+        return columns
+
+    @classmethod
+    def _decode(cls, data, name, columns):
+        '将pack()得到的数组还原为DataFrame'
+        result = {}
+        for col, kind in columns:
+            key = f'{name}/{col}'
+            values = data[key]
+            if kind in ('object', 'category'):
+                cat = pd.Categorical.from_codes(
+                    values, data[key + '/categories'].astype(object))
+                result[col] = cat if kind == 'category' else np.asarray(
+                    cat, dtype=object)
+            elif kind == 'values':
+                result[col] = values
+            else:
+                result[col] = values.view(kind)
+        return pd.DataFrame(result)
+
+
+class ImageCache:
+    '''
+    按内容寻址的图片缓存
+功能：
+1.图片文件名为原文件名加内容哈希值，如fee_of_mode_1_to_16-<哈希值>.png
+  哈希值由绘图数据，图片类型和输出配置得出，见draw.Draw.digest
+  数据未改变时文件已存在，无需重新绘制
+2.命中缓存时更新文件的修改时间，evict()按修改时间删除最久未使用的图片，
+  使文件夹中缓存图片的总大小不超过max_bytes
+3.只删除带哈希值的图片，不删除文件夹中的其他文件
+'''
+    MAX_BYTES = 200 << 20       # 缓存图片总大小上限，200MB
+    DIGEST_LEN = 16
+    PATTERN = re.compile(r'-[0-9a-f]{%d}\.\w+$' % DIGEST_LEN)
+
+    def __init__(self, folder=None, max_bytes=None):
+        '''folder:图片文件夹，默认为当前文件夹下的images
+        max_bytes:缓存图片的总大小上限，单位字节
+        '''
+        self.folder = folder or fp.make_dir('images')
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+
+    @classmethod
+    def path(cls, fig_path, digest):
+        'fig_path加上哈希值后的图片路径'
+        root, ext = os.path.splitext(fig_path)
+        return f'{root}-{digest[:cls.DIGEST_LEN]}{ext}'
+
+    def hit(self, fig_path):
+        '图片是否已存在，存在时更新修改时间'
+        if not os.path.exists(fig_path):
+            return False
+        os.utime(fig_path)
+        return True
+
+    def evict(self, keep=()):
+        '''删除最久未使用的缓存图片，直到总大小不超过max_bytes
+        keep:不删除的图片路径，如当前报告中的图片
+        返回删除的文件数
+        '''
+        keep = {os.path.abspath(p) for p in keep}
+        files = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and self.PATTERN.search(entry.name):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+if __name__ == '__main__':
+    import sys
+    for f in sys.argv[1:]:
+        print(FrameCache.fingerprint(f))
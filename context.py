@@ -6,7 +6,7 @@
 '''
 利用docxtpl渲染Word所需context
 '''
-import docx
+import io
 import jinja2
 from docxtpl import DocxTemplate, InlineImage
 from filepath import filePath as fp
@@ -44,9 +44,20 @@ class vehiclesContext:
     通过Vehicles对象，渲染Word模板
     '''
 
-    def __init__(self, vehicles, template='template.docx'):
+    def __init__(self, vehicles, template='template.docx', profile=None):
+        '''vehicles:Vehicles对象
+        template:Word模板文件名，或模板文件的内容(bytes)
+                 批量生成时只读取一次模板文件，见batch.py
+        profile:图片输出配置，'draft','print'或'archive'，见draw.Draw.PROFILES
+                默认使用vehicles当前的配置
+        '''
         self.vehicles = vehicles
-        self.tpl = DocxTemplate(fp(template).as_template_file)
+        if profile is not None:
+            vehicles.render_profile = profile
+        if isinstance(template, bytes):
+            self.tpl = DocxTemplate(io.BytesIO(template))
+        else:
+            self.tpl = DocxTemplate(fp(template).as_template_file)
         self.context = {}
         self._title_and_overview()
         self._all_modes()
@@ -65,31 +76,30 @@ class vehiclesContext:
         for key in key_value_dict:
             self.context[key] = key_value_dict[key]
 
-    def _remove_empty_lines(self, filename):
+    def _remove_empty_lines(self):
         '''
         docxtpl渲染结果暂时不知道怎样删除多余的空白行
-        用python-docx集中全部删除
+        渲染后直接在内存中的文档上全部删除，无需保存后再打开
+        没有文字且不含图片（w:drawing）的段落为空白行
+        '''
+        for paragraph in self.tpl.docx.paragraphs:
+            p = paragraph._p
+            if len(paragraph.text) == 0 and not p.xpath('.//w:drawing'):
+                p.getparent().remove(p)
+
+    def rend(self, name=None):
+        '''渲染并保存报告，返回报告文件路径
+        name:报告文件名前缀，默认为统计的月份，如'2021年12月'
         '''
-        def delete_paragraph(paragraph):
-            p = paragraph._element
-            p.getparent().remove(p)
-            paragraph._p = paragraph._element = None
-
-        document = docx.Document(filename)  # 打开
-        for paragraph in document.paragraphs:
-            if len(paragraph.text) == 0:
-                if 'graphicData' not in paragraph._p.xml:  # 判断是否为单行图片
-                    delete_paragraph(paragraph)
-        document.save(filename)  # 关闭
-
-    def rend(self):
         station = self.context['station']
-        month_gap = self.context['month_gap']
+        name = name or self.context['month_gap']
         report_file = fp(
-            f'{month_gap}{station}通行费收入分析.docx').as_report_file
+            f'{name}{station}通行费收入分析.docx').as_report_file
+        # 图片可能由进程池并行绘制，全部完成后再插入Word
+        self.vehicles.wait_figures()
         self.tpl.render(self.context, jinja_env)
+        self._remove_empty_lines()
         self.tpl.save(report_file)
-        self._remove_empty_lines(report_file)
         return report_file
 
     def _register_fig(self, fig_path):
@@ -6,6 +6,7 @@
 '''
 利用decimal模块计算panda的series对象
 '''
+import numpy as np
 from decimal import ROUND_HALF_UP, Decimal
 from functools import reduce
 
@@ -14,7 +15,12 @@ class D:
     '''
     decimal模块计算费用
 对pandas的Series进行操作
+
+Series为整数类型时，视为以分为单位的通行费（int64），
+求和、占比及四舍五入均用numpy整数运算完成，结果与Decimal逐个累加一致。
+其他类型（字符串，float）仍使用Decimal逐个累加。
 '''
+    FEN = 100                   # 1元=100分
 
     def __init__(self, series):
         '''
@@ -44,6 +50,55 @@ class D:
         else:
             return x
 
+    @classmethod
+    def is_fen(cls, series):
+        '是否为以分为单位的整数Series或数组'
+        dtype = getattr(series, 'dtype', None)
+        return getattr(dtype, 'kind', None) in ('i', 'u')
+
+    @classmethod
+    def to_fen(cls, series):
+        '''将通行费字符串Series转换为以分为单位的int64
+        通行费金额最多两位小数，float64解析后放大100倍取整是精确的
+        '''
+        return np.rint(series.astype(np.float64) * cls.FEN).astype(np.int64)
+
+    @classmethod
+    def from_fen(cls, fen):
+        '将以分为单位的整数转换为以元为单位的Decimal对象'
+        return Decimal(int(fen)).scaleb(-2)
+
+    @classmethod
+    def round_half_up(cls, up, below):
+        '''整数除法up/below,按ROUND_HALF_UP取整
+        up可为numpy数组，below为正整数
+        '''
+        up = np.asarray(up, dtype=np.int64)
+        return np.sign(up) * ((2 * np.abs(up) + below) // (2 * below))
+
+    @classmethod
+    def fen_to_float(cls, fen, scale=False, rounding=False):
+        '''将分转换为元，与sum()参数意义相同
+        scale:缩小10000倍，即万元
+        rounding:保留两位小数，以元为单位时已精确到分，无需处理
+        '''
+        fen = np.asarray(fen, dtype=np.int64)
+        if scale:
+            if rounding:
+                return cls.round_half_up(fen, 10000) / cls.FEN
+            return fen / (cls.FEN * 10000)
+        return fen / cls.FEN
+
+    @classmethod
+    def fen_per(cls, fen, total, rounding=True):
+        '''以分为单位的fen占total的百分比，与per()参数意义相同
+        rounding时先计算万分比的整数，再缩小100倍
+        '''
+        fen = np.asarray(fen, dtype=np.int64)
+        if rounding:
+            return cls.round_half_up(fen * 10000, int(total)) / 100
+        return fen * 100 / int(total)
+
     @classmethod
     def divide(cls, up, below):
         'decimal除法,返回Decimal对象'
@@ -78,9 +133,15 @@ class D:
         '''
         return reduce(lambda x, y: x+self.to_decimal(y), self.series, Decimal('0'))
 
+    def fen(self):
+        '以分为单位的Series的总和，返回int'
+        return int(np.asarray(self.series, dtype=np.int64).sum())
+
     def sum(self, scale=False, rounding=False):
         '''求Series对象的总和，支持缩放和默认保留两位小数
         '''
+        if self.is_fen(self.series):
+            return float(self.fen_to_float(self.fen(), scale, rounding))
         dresult = self._sum()
         if scale:
             dresult = self.scale(dresult)
@@ -91,7 +152,10 @@ class D:
     def per(self, total, rounding=True):
         '''根据总量total，计算Series总和的占比
         默认放大100倍，保留两位小数
+        Series以分为单位时，total也应以分为单位
         '''
+        if self.is_fen(self.series):
+            return float(self.fen_per(self.fen(), total, rounding))
         amount = self._sum()
         dresult = self.divide(amount, total)
         dresult = self.scale(dresult, 0.01)
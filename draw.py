@@ -6,58 +6,228 @@
 '''
 绘制图片
 '''
-import matplotlib as mpl
-import seaborn as sns
+import hashlib
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+from cache import ImageCache
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from d import D
 from decimal import Decimal
 from filepath import filePath as fp
-from matplotlib import pyplot as plt
 
-mpl.font_manager.fontManager.addfont(fp('SimHei.ttf').as_resource_file)
-mpl.rcParams['font.sans-serif'] = ['SimHei']
-mpl.rcParams['axes.unicode_minus'] = False
-mpl.rcParams['savefig.bbox'] = 'tight'
-mpl.rcParams['savefig.transparent'] = True
+# matplotlib和seaborn导入较慢，只读取数据时不需要
+# 第一次绘图时由setup()导入，见Draw.__init__
+mpl = sns = plt = Figure = FigureCanvasAgg = None
+# 直接用ax.bar绘制的柱状图是否与已安装的seaborn一致，由setup()设置，见Draw._barplot
+direct_barplot = False
 
-mpl.rcParams['savefig.dpi'] = 1000
-# mpl.rcParams['savefig.pad_inches'] = 0.01
-sns.set(font='SimHei', style='white', context='paper')
 
-mpl.rcParams['figure.max_open_warning'] = False
+def setup(backend=None):
+    '''导入matplotlib和seaborn，注册SimHei字体，设置绘图参数
+    每个进程只执行一次，之后直接返回
+    backend:matplotlib后端，如'Agg'，默认不改变
+    '''
+    global mpl, sns, plt, Figure, FigureCanvasAgg, direct_barplot
+    if plt is not None:
+        return
+    import matplotlib as mpl
+    if backend:
+        mpl.use(backend)
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    # seaborn 0.13起无hue的barplot只用一种颜色，_barplot按0.12的调色板绘制
+    direct_barplot = tuple(int(v) for v in sns.__version__.split('.')[:2]) < (0, 13)
+
+    mpl.font_manager.fontManager.addfont(fp('SimHei.ttf').as_resource_file)
+    mpl.rcParams['font.sans-serif'] = ['SimHei']
+    mpl.rcParams['axes.unicode_minus'] = False
+    mpl.rcParams['savefig.bbox'] = 'tight'
+    mpl.rcParams['savefig.transparent'] = True
+
+    mpl.rcParams['savefig.dpi'] = 1000
+    # mpl.rcParams['savefig.pad_inches'] = 0.01
+    sns.set(font='SimHei', style='white', context='paper')
+
+
+def _setup_worker():
+    '绘图进程的初始化函数，每个进程只执行一次'
+    setup('Agg')
+
+
+def render(kind, df, fig_path, profile='archive'):
+    '''绘制一张图片，kind为Draw的方法名，如'for_primary'
+    profile:见Draw.PROFILES
+    先写入临时文件再替换，中断后不会留下不完整的缓存图片
+    返回fig_path
+    '''
+    root, ext = os.path.splitext(fig_path)
+    tmp_path = f'{root}.{os.getpid()}.tmp{ext}'
+    getattr(Draw(df, tmp_path, profile=profile), kind)()
+    os.replace(tmp_path, fig_path)
+    return fig_path
 
 
 class Draw:
+    '''
+    绘制报告中的图片，每个for_...方法绘制一张图片并保存到fig_path
+图片由_figure()创建，保存后立即释放，不在pyplot中累积
+'''
     FW = 10                     # Word横向放置适合很跨整个页面的宽度
+    VERSION = 1                 # 绘图代码改变时加1，使缓存的图片失效，见digest
+    # 输出配置：dpi, bbox为savefig的bbox_inches，format为'png'或'png8'
+    # 'png8'将图片量化为256色调色板PNG，文件约为png的1/3，颜色略有差异
+    # bbox为'tight'时按内容裁剪，None时不裁剪，倾斜的标签可能被截断
+    # 实测'tight'与None耗时相近，所以都使用'tight'
+    # python-docx只支持位图（PNG, JPEG等），不支持SVG和EMF
+    # backend为柱状图的绘制方式，见_barplot，两种方式的图片逐像素相同
+    # 15张图片的报告，单核上绘图并生成Word的耗时，图片总大小，Word文件大小：
+    # draft 5.7秒 0.09MB 0.08MB，print 8.5秒 0.24MB 0.14MB，
+    # archive 25.5秒 3.0MB 1.46MB
+    PROFILES = {
+        'draft':   {'dpi': 150, 'bbox': 'tight', 'format': 'png8',
+                    'backend': 'matplotlib'},
+        'print':   {'dpi': 300, 'bbox': 'tight', 'format': 'png8',
+                    'backend': 'seaborn'},
+        'archive': {'dpi': 1000, 'bbox': 'tight', 'format': 'png',
+                    'backend': 'seaborn'},
+    }
+    BACKENDS = ('seaborn', 'matplotlib')
 
-    def __init__(self, df, fig_path):
+    def __init__(self, df, fig_path, pyplot=True, profile='archive',
+                 backend=None):
         '''
         df:pandas的dataFrame对象
+        pyplot:True时用plt.subplots创建图片，保存后plt.close
+               False时直接创建Figure和Agg画布，不经过pyplot，无全局状态
+        profile:输出配置名称，见PROFILES，默认'archive'与原来的输出相同
+        backend:柱状图的绘制方式，见_barplot，默认使用输出配置中的backend
         '''
+        setup()
         self.df = df
         self.fig_path = fig_path
+        self.pyplot = pyplot
+        self.profile = self.get_profile(profile)
+        self.backend = backend or self.profile['backend']
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f'未知的绘制方式：{self.backend}，'
+                             f'可选：{list(self.BACKENDS)}')
+
+    @classmethod
+    def get_profile(cls, profile):
+        '获取输出配置，名称不存在时抛出ValueError'
+        if profile not in cls.PROFILES:
+            raise ValueError(f'未知的输出配置：{profile}，'
+                             f'可选：{list(cls.PROFILES)}')
+        return cls.PROFILES[profile]
+
+    @classmethod
+    def digest(cls, kind, df, profile='archive'):
+        '''用kind方法绘制df时，图片的内容哈希值
+        由VERSION，kind，输出配置，df的列名，类型和数据得出，无需导入matplotlib
+        '''
+        sha1 = hashlib.sha1(json.dumps([
+            cls.VERSION, kind, cls.get_profile(profile),
+            [str(c) for c in df.columns],
+            [str(t) for t in df.dtypes]]).encode('utf-8'))
+        sha1.update(pd.util.hash_pandas_object(
+            df, index=False).to_numpy().tobytes())
+        return sha1.hexdigest()
+
+    @contextmanager
+    def _figure(self, figsize):
+        '''创建图片，返回(fig, ax)
+        with语句正常结束时保存到fig_path，无论是否出错都释放图片
+        '''
+        if self.pyplot:
+            fig, ax = plt.subplots(figsize=figsize)
+        else:
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            ax = fig.subplots()
+        try:
+            yield fig, ax
+            self._save(fig)
+        finally:
+            if self.pyplot:
+                plt.close(fig)
+
+    def _save(self, fig):
+        '按输出配置保存图片'
+        profile = self.profile
+        options = {'dpi': profile['dpi'], 'bbox_inches': profile['bbox']}
+        if profile['format'] == 'png':
+            fig.savefig(self.fig_path, **options)
+            return
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', **options)
+        buffer.seek(0)
+        from PIL import Image
+        with Image.open(buffer) as image:
+            # RGBA图片只能用FASTOCTREE(2)量化，保留透明背景
+            image.quantize(256, method=2).save(self.fig_path, optimize=True)
+
+    def _barplot(self, ax, df, x, y, orient='v'):
+        '''绘制柱状图，df为已汇总的数据，每个类别一行
+        backend为'seaborn'时用sns.barplot
+        为'matplotlib'时直接用ax.bar/ax.barh绘制，不经过seaborn的估计和置信区间计算，
+        颜色，柱宽，刻度，坐标范围与seaborn 0.12的sns.barplot相同（requirements.txt）
+        已安装的seaborn>=0.13时（direct_barplot为False）仍用sns.barplot
+        '''
+        if self.backend == 'seaborn' or not direct_barplot:
+            sns.barplot(ax=ax, data=df, x=x, y=y, orient=orient)
+            return
+        names, values = (df[x], df[y]) if orient == 'v' else (df[y], df[x])
+        nrows = df.shape[0]
+        # 与sns.barplot相同：类别数不超过当前调色板时用调色板，否则用husl
+        if nrows <= len(sns.color_palette()):
+            colors = sns.color_palette(n_colors=nrows)
+        else:
+            colors = sns.husl_palette(nrows, l=.7)
+        colors = sns.color_palette(colors, desat=.75)
+        positions = np.arange(nrows)
+        if orient == 'v':
+            ax.bar(positions, values.to_numpy(), .8, color=colors,
+                   align='center')
+            ax.set_xticks(positions)
+            ax.set_xticklabels(names.to_list())
+            ax.xaxis.grid(False)
+            ax.set_xlim(-.5, nrows - .5, auto=None)
+        else:
+            ax.barh(positions, values.to_numpy(), .8, color=colors,
+                    align='center')
+            ax.set_yticks(positions)
+            ax.set_yticklabels(names.to_list())
+            ax.yaxis.grid(False)
+            ax.set_ylim(-.5, nrows - .5, auto=None)
+            ax.invert_yaxis()
+        ax.set(xlabel=x, ylabel=y)
 
     def for_all_modes(self):
         df = self.df.sort_values(by='fee', ascending=False)
-        fig, ax = plt.subplots(figsize=(self.FW, 1.7))
-        sns.barplot(ax=ax, data=df, x='mode', y='fee')
-        sns.despine()
-        ax.set(xlabel='', ylabel='通行费（万元）')
-        ax.bar_label(ax.containers[0], df['fee'].map(
-            lambda f: f'{f:.2f}').to_list())
-        fig.savefig(self.fig_path)
+        with self._figure((self.FW, 1.7)) as (fig, ax):
+            self._barplot(ax, df, x='mode', y='fee')
+            sns.despine(ax=ax)
+            ax.set(xlabel='', ylabel='通行费（万元）')
+            ax.bar_label(ax.containers[0], df['fee'].map(
+                lambda f: f'{f:.2f}').to_list())
 
     def for_cars_and_trucks(self):
         df = self.df.sort_values(by='fee', ascending=False)
         nrows = df.shape[0]
-        fig, ax = plt.subplots(figsize=(self.FW/2, (nrows+1)*0.46))
-        sns.barplot(ax=ax, data=df, x='fee', y='mode', orient='h')
-        sns.despine(right=True, bottom=True)
-        ax.xaxis.set_label_position('top')
-        ax.set(ylabel='', xlabel='通行费（万元）')
-        ax.xaxis.tick_top()
-        ax.bar_label(ax.containers[0], df['fee'].map(
-            lambda f: f'{f:.2f}').to_list())
-        fig.savefig(self.fig_path)
+        with self._figure((self.FW/2, (nrows+1)*0.46)) as (fig, ax):
+            self._barplot(ax, df, x='fee', y='mode', orient='h')
+            sns.despine(ax=ax, right=True, bottom=True)
+            ax.xaxis.set_label_position('top')
+            ax.set(ylabel='', xlabel='通行费（万元）')
+            ax.xaxis.tick_top()
+            ax.bar_label(ax.containers[0], df['fee'].map(
+                lambda f: f'{f:.2f}').to_list())
 
     def for_in_vs_out(self):
         cats, pers = [], []
@@ -66,11 +236,10 @@ class Draw:
             pers.append(record['per'])
         colors = sns.color_palette(n_colors=2)
 
-        fig, ax = plt.subplots(figsize=(self.FW/2, 1.8))
-        wedget, texts, autotexts = ax.pie(
-            pers, autopct='%1.2f%%', colors=colors)
-        ax.legend(wedget, cats, loc=(1.04, 0))
-        fig.savefig(self.fig_path)
+        with self._figure((self.FW/2, 1.8)) as (fig, ax):
+            wedget, texts, autotexts = ax.pie(
+                pers, autopct='%1.2f%%', colors=colors)
+            ax.legend(wedget, cats, loc=(1.04, 0))
 
     def for_primary(self):
         nrows = self.df.shape[0]
@@ -89,22 +258,20 @@ class Draw:
             x = 'province'
         else:
             x = 'station'
-        fig, ax = plt.subplots(figsize=(self.FW, 3))
-        sns.barplot(ax=ax, data=df, x=x,  y='fee')
-        sns.despine()
-        ax.set(xlabel='', ylabel='通行费（万元）')
-        # 根据数据条数决定是否在bar上添加数值
-        if nrows <= 15:
-            ax.bar_label(ax.containers[0], df['fee'].map(
-                lambda f: f'{f:.2f}').to_list())
-        # 根据xticksi字符串是否过长，设置倾斜
-        if df[x].str.len().max() >= 4:
-            labels = ax.get_xticklabels()
-            plt.setp(labels, rotation=80,
-                     horizontalalignment='center',
-                     fontsize='smaller')
-
-        fig.savefig(self.fig_path)
+        with self._figure((self.FW, 3)) as (fig, ax):
+            self._barplot(ax, df, x=x,  y='fee')
+            sns.despine(ax=ax)
+            ax.set(xlabel='', ylabel='通行费（万元）')
+            # 根据数据条数决定是否在bar上添加数值
+            if nrows <= 15:
+                ax.bar_label(ax.containers[0], df['fee'].map(
+                    lambda f: f'{f:.2f}').to_list())
+            # 根据xticksi字符串是否过长，设置倾斜
+            if df[x].str.len().max() >= 4:
+                labels = ax.get_xticklabels()
+                plt.setp(labels, rotation=80,
+                         horizontalalignment='center',
+                         fontsize='smaller')
 
     def _pie_for_primary(self):
         df = self.df.sort_values(by='fee', ascending=False)
@@ -126,27 +293,81 @@ class Draw:
             cats.append('其他')
             colors = sns.color_palette(n_colors=nrows+1)
 
-        fig, ax = plt.subplots(figsize=(self.FW, 3))
-        wedget, text, autotexts = ax.pie(pers, autopct='%1.2f%%')
-        ax.legend(wedget, cats, loc=(1.04, 0))
-        fig.savefig(self.fig_path)
+        with self._figure((self.FW, 3)) as (fig, ax):
+            wedget, text, autotexts = ax.pie(pers, autopct='%1.2f%%')
+            ax.legend(wedget, cats, loc=(1.04, 0))
 
     def for_topmost_plates(self):
         df = self.df.sort_values(by='fee', ascending=False)
         nrows = df.shape[0]
-        fig, ax = plt.subplots(figsize=(self.FW, 3))
-        sns.barplot(ax=ax, data=df, x='plate',  y='fee')
-        sns.despine()
-        ax.set(xlabel='', ylabel='通行费（元）')
-        # 根据数据条数决定是否在bar上添加数值
-        ax.bar_label(ax.containers[0],
-                     df['count'].to_list(),
-                     label_type='edge')
-
-        # 设置倾斜
-        labels = ax.get_xticklabels()
-        plt.setp(labels, rotation=80,
-                 horizontalalignment='center',
-                 fontsize='smaller')
-
-        fig.savefig(self.fig_path)
+        with self._figure((self.FW, 3)) as (fig, ax):
+            self._barplot(ax, df, x='plate',  y='fee')
+            sns.despine(ax=ax)
+            ax.set(xlabel='', ylabel='通行费（元）')
+            # 根据数据条数决定是否在bar上添加数值
+            ax.bar_label(ax.containers[0],
+                         df['count'].to_list(),
+                         label_type='edge')
+
+            # 设置倾斜
+            labels = ax.get_xticklabels()
+            plt.setp(labels, rotation=80,
+                     horizontalalignment='center',
+                     fontsize='smaller')
+
+
+class Renderer:
+    '''
+    绘图任务队列
+功能：
+1.submit()提交绘图任务(kind, df, fig_path)，workers>1时由进程池并行绘制，
+  否则立即在当前进程中绘制
+2.每个绘图进程启动时注册一次字体，设置绘图参数，见_setup_worker
+3.wait()等待所有已提交的任务完成，返回图片路径，任务出错时抛出异常
+  完成后关闭进程池，再次submit时重新创建
+4.图片按内容缓存，见cache.ImageCache，数据和配置未改变时不重新绘制
+'''
+
+    def __init__(self, workers=1, profile='archive', cache=None):
+        '''workers:绘图进程数，<=1时不使用进程池
+        profile:图片输出配置，见Draw.PROFILES
+        cache:cache.ImageCache对象，默认缓存在images文件夹
+        '''
+        self.workers = workers or 1
+        self.profile = profile
+        self.cache = cache or ImageCache()
+        self._executor = None
+        self._jobs = {}         # {fig_path:Future}
+
+    def path(self, kind, df, fig_path):
+        '绘图任务的图片路径，即fig_path加上内容哈希值，不绘制图片'
+        return self.cache.path(fig_path, Draw.digest(kind, df, self.profile))
+
+    def submit(self, kind, df, fig_path, force=False):
+        '''提交绘图任务
+        fig_path:不含哈希值的图片路径
+        force:为True时即使已有缓存也重新绘制
+        返回加上内容哈希值后的图片路径，已缓存时不再绘制
+        '''
+        fig_path = self.path(kind, df, fig_path)
+        if fig_path in self._jobs or (not force and self.cache.hit(fig_path)):
+            return fig_path
+        if self.workers <= 1:
+            render(kind, df, fig_path, self.profile)
+            return fig_path
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_setup_worker)
+        self._jobs[fig_path] = self._executor.submit(
+            render, kind, df, fig_path, self.profile)
+        return fig_path
+
+    def wait(self):
+        '等待所有任务完成，返回已完成的图片路径list'
+        try:
+            return [job.result() for job in self._jobs.values()]
+        finally:
+            self._jobs = {}
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
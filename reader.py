@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# reader.py
+# Author: Claudio <3261958605@qq.com>
+# Created: 2026-10-17 10:05:31
+# Code:
+'''
+用openpyxl的只读模式逐行读取Excel，不一次性载入整个工作簿
+'''
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+
+class StreamReader:
+    '''
+    逐行读取Excel文件的第一个sheet，按固定行数分块返回DataFrame
+功能：
+1.openpyxl的read_only模式，iter_rows(values_only=True)逐行读取，内存占用只与分块大小有关
+2.只保留columns中的列，每列分别存入list，满chunk_size行后转换为DataFrame
+3.str_columns中的列转换为字符串，与pandas.read_excel(dtype=str)结果一致
+
+只支持xlsx等openpyxl可读取的格式，其他格式用supports()判断后改用pandas.read_excel
+'''
+    CHUNK_SIZE = 100000
+    EXTENSIONS = ('.xlsx', '.xlsm')
+
+    def __init__(self, excel_file, header, columns, str_columns=(),
+                 chunk_size=None):
+        '''
+        excel_file:Excel文件路径
+        header:表头所在行，从0开始，与pandas.read_excel的header参数一致
+        columns:需读取的列名list
+        str_columns:需转换为字符串的列名
+        chunk_size:每块的行数
+        '''
+        self.excel_file = excel_file
+        self.header = header
+        self.columns = list(columns)
+        self.str_columns = set(str_columns)
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+
+    @classmethod
+    def supports(cls, excel_file):
+        '是否可以用openpyxl读取'
+        return os.path.splitext(excel_file)[1].lower() in cls.EXTENSIONS
+
+    @classmethod
+    def to_str(cls, value):
+        '''与pandas.read_excel(dtype=str)相同：
+        整数值的float先转换为int，空单元格为NaN
+        '''
+        if value is None:
+            return np.nan
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+
+    def chunks(self):
+        '''逐块返回DataFrame，列名与columns相同
+        至少返回一块，文件中没有数据时返回空DataFrame
+        '''
+        workbook = load_workbook(self.excel_file, read_only=True,
+                                 data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            # 与pandas相同，不信任文件中记录的范围(<dimension>)，
+            # 部分导出程序记录的范围有误，按记录的范围读取会丢失数据
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(min_row=self.header+1, values_only=True)
+            header_row = next(rows, ())
+            missing = [c for c in self.columns if c not in header_row]
+            if missing:
+                raise ValueError(f'{self.excel_file}中没有列：{missing}')
+            indexes = [header_row.index(c) for c in self.columns]
+
+            buffers = [[] for _ in self.columns]
+            yielded = False
+            for row in rows:
+                values = [row[i] if i < len(row) else None for i in indexes]
+                # 与pandas相同，跳过空行
+                if all(v is None for v in values):
+                    continue
+                for buffer, value in zip(buffers, values):
+                    buffer.append(value)
+                if len(buffers[0]) >= self.chunk_size:
+                    yield self._to_frame(buffers)
+                    yielded = True
+                    buffers = [[] for _ in self.columns]
+            if buffers[0] or not yielded:
+                yield self._to_frame(buffers)
+        finally:
+            workbook.close()
+
+    def _to_frame(self, buffers):
+        '将每列的list转换为DataFrame'
+        data = {}
+        for col, buffer in zip(self.columns, buffers):
+            if col in self.str_columns:
+                data[col] = pd.Series([self.to_str(v) for v in buffer],
+                                      dtype=object)
+            else:
+                data[col] = pd.Series(buffer, dtype=None if buffer else object)
+        return pd.DataFrame(data)
+
+
+if __name__ == '__main__':
+    import sys
+    for chunk in StreamReader(sys.argv[1], 3, sys.argv[2:]).chunks():
+        print(chunk)
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+# store.py
+# Author: Claudio <3261958605@qq.com>
+# Created: 2026-10-17 15:40:12
+# Code:
+'''
+增量保存清理后的数据，新增Excel文件时只读取新文件，不重新读取历史数据
+'''
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from cache import FrameCache
+from filepath import filePath as fp
+from vehicles import Vehicles
+
+
+class VehiclesStore:
+    '''
+    按日保存清理后的数据，及各日的聚合数据
+功能：
+1.manifest.json记录已保存的Excel文件（编号，大小，修改时间，原始行数，出口收费站，
+  涉及的日期）和各日的数据（起止时间，去重后的行数）
+2.days/日期.npz保存当日所有文件中的行(rows)，source列为行所在文件的编号，
+  不同文件之间的重复行也保留，以便单独删除某个文件的行
+  及由去重后的行得出的聚合数据(cube, plate_cube)，见Vehicles.aggregate
+  不同文件中的重复行出口时间相同，只需在同一日内去重，见Vehicles.dedupe
+3.others.npz保存station为空的行(no_source)和出口时间无法识别的行(malformed)，
+  同样有source列
+4.cubes.npz保存所有日聚合数据的合并结果，Vehicles.from_store只需读取此文件
+5.add()只清理未保存的文件，只重写这些文件涉及的日期，再合并各日的聚合数据
+  耗时与新增数据量成正比，合并聚合数据只与天数有关，数据量很小
+
+已保存的文件修改后（如重新导出某日数据覆盖原文件），add()时删除其原有的行，
+重新读取，只重写新旧数据涉及的日期
+同一文件重复添加时，其中的行都是重复行，不会重复计入
+
+VERSION:保存格式或清理流程改变时加1，旧数据自动清除
+'''
+    VERSION = 2
+    MANIFEST = 'manifest.json'
+    DAY_FORMAT = '%Y-%m-%d'
+
+    def __init__(self, folder=None):
+        '''folder:保存数据的文件夹，默认为当前文件夹下的store
+        '''
+        self.folder = folder or fp.make_dir('store')
+        self.manifest = self._load_manifest()
+        if self.manifest['version'] != self.VERSION:
+            print(f'{self.folder}中的数据格式已过期，清除后需重新添加所有文件')
+            self.clear()
+
+    def _path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def _day_file(self, day):
+        return self._path('days', f'{day}.npz')
+
+    @classmethod
+    def _empty_manifest(cls):
+        return {'version': cls.VERSION, 'next_id': 0, 'files': {}, 'days': {}}
+
+    def _load_manifest(self):
+        manifest_file = self._path(self.MANIFEST)
+        if not os.path.exists(manifest_file):
+            return self._empty_manifest()
+        with open(manifest_file, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        manifest_file = self._path(self.MANIFEST)
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, manifest_file)
+
+    @classmethod
+    def _save(cls, path, frames):
+        '将dict{名称:DataFrame}保存为npz文件，先写入临时文件再替换'
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **FrameCache.pack(frames))
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def _load(cls, path, names=None):
+        '读取_save()保存的文件，names:只读取其中的DataFrame'
+        with np.load(path, allow_pickle=False) as data:
+            return FrameCache.unpack(data, names)[0]
+
+    @classmethod
+    def _stat(cls, path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @classmethod
+    def _drop_sources(cls, rows, sources):
+        '删除rows中source列为sources中编号的行，及只在这些行中出现的类别'
+        if not sources:
+            return rows
+        rows = rows[~rows['source'].isin(sources)].reset_index(drop=True)
+        for col in rows.columns:
+            if isinstance(rows[col].dtype, pd.CategoricalDtype):
+                rows[col] = rows[col].cat.remove_unused_categories()
+        return rows
+
+    @classmethod
+    def _dedupe(cls, rows):
+        '''去除rows中的重复行（保留最先添加的），并删除source列
+        返回(去重后的行, 重复行的bool数组)
+        '''
+        duplicated = Vehicles.duplicated(rows)
+        frame = rows[~duplicated].drop(columns='source').reset_index(drop=True)
+        return frame, duplicated
+
+    def clear(self):
+        '删除所有已保存的数据'
+        shutil.rmtree(self._path('days'), ignore_errors=True)
+        for name in ('others.npz', 'cubes.npz', self.MANIFEST):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.manifest = self._empty_manifest()
+
+    def add(self, excel_files, workers=1, reader='stream'):
+        '''清理未保存或保存后已修改的Excel文件，合并到已保存的数据中
+        已修改的文件先删除其原有的行，再按新内容添加
+        workers, reader:见Vehicles.__init__
+        返回新增或重新读取的文件list
+        '''
+        new_files, removed = {}, {}
+        for excel_file in excel_files:
+            path = os.path.abspath(excel_file)
+            saved = self.manifest['files'].get(path)
+            if saved is not None and saved['stat'] == self._stat(path):
+                continue
+            if saved is not None and path not in removed:
+                print(f'{excel_file}保存后已修改，重新读取')
+                removed[path] = saved
+            new_files.setdefault(path, excel_file)
+        if not new_files:
+            return []
+
+        removed_sources = set()
+        affected_days = set()
+        for path, saved in removed.items():
+            removed_sources.add(saved['id'])
+            affected_days.update(saved['days'])
+            del self.manifest['files'][path]
+
+        parts = {'frame': [], 'no_source': [], 'malformed': []}
+        names = {}              # {文件编号:文件名}，用于提示重复行
+        packs = Vehicles._load_excel_files(list(new_files), workers, reader)
+        for (path, excel_file), packed in zip(new_files.items(), packs):
+            print(excel_file)
+            file_frames, meta = FrameCache.unpack(packed)
+            source = self.manifest['next_id']
+            self.manifest['next_id'] += 1
+            names[source] = excel_file
+            for name, file_frame in file_frames.items():
+                parts[name].append(file_frame.assign(source=np.uint32(source)))
+            nrows_malformed = file_frames['malformed'].shape[0]
+            if nrows_malformed:
+                print(f'{excel_file}：{nrows_malformed}行出口时间无法识别，未计入统计')
+            days = file_frames['frame']['datetime'].dt.strftime(self.DAY_FORMAT)
+            self.manifest['files'][path] = {'id': source,
+                                            'stat': self._stat(path),
+                                            'nrows': meta['nrows'],
+                                            'exits': meta['exits'],
+                                            'days': sorted(days.unique())}
+
+        os.makedirs(self._path('days'), exist_ok=True)
+        frame = Vehicles.concat_frames(parts['frame'])
+        days = frame['datetime'].dt.strftime(self.DAY_FORMAT)
+        new_rows = dict(iter(frame.groupby(days, sort=True)))
+        duplicates = {}
+        for day in sorted(affected_days.union(new_rows)):
+            self._update_day(day, new_rows.get(day), removed_sources,
+                             duplicates)
+        for source, count in duplicates.items():
+            print(f'{names[source]}：{count}行与已读取的行重复，未重复计入')
+        self._update_others(parts, removed_sources)
+        self._merge_cubes()
+        self._save_manifest()
+        return list(new_files.values())
+
+    def _update_day(self, day, rows, removed_sources, duplicates):
+        '''重写一日的数据：删除removed_sources中文件的行，添加新增的行rows，
+        去重后重新得出当日的聚合数据，没有行时删除当日数据
+        duplicates:累计新增的行中与已有行重复的行数{文件编号:行数}
+        '''
+        day_file = self._day_file(day)
+        parts = []
+        if os.path.exists(day_file):
+            saved = self._load(day_file, ['rows'])['rows']
+            parts.append(self._drop_sources(saved, removed_sources))
+        nrows_saved = parts[0].shape[0] if parts else 0
+        if rows is not None:
+            parts.append(rows)
+        parts = [part for part in parts if part.shape[0]]
+        if not parts:
+            if os.path.exists(day_file):
+                os.remove(day_file)
+            self.manifest['days'].pop(day, None)
+            return
+
+        rows = Vehicles.concat_frames(parts)
+        frame, duplicated = self._dedupe(rows)
+        new_sources = rows['source'].to_numpy()[nrows_saved:]
+        for source, count in zip(*np.unique(new_sources[duplicated[nrows_saved:]],
+                                            return_counts=True)):
+            duplicates[int(source)] = duplicates.get(int(source), 0) + int(count)
+        frames = {'rows': rows}
+        frames.update(Vehicles.aggregate(frame))
+        self._save(day_file, frames)
+        self.manifest['days'][day] = {'begin': str(frame['datetime'].min()),
+                                      'end': str(frame['datetime'].max()),
+                                      'nrows': frame.shape[0]}
+
+    def _update_others(self, parts, removed_sources):
+        '''合并station为空的行和出口时间无法识别的行，
+        删除removed_sources中文件原有的行
+        '''
+        others_file = self._path('others.npz')
+        if os.path.exists(others_file):
+            saved = self._load(others_file)
+            for name in ('no_source', 'malformed'):
+                parts[name].insert(0, self._drop_sources(saved[name],
+                                                         removed_sources))
+        self._save(others_file, {
+            name: Vehicles.concat_frames(parts[name])
+            for name in ('no_source', 'malformed')})
+
+    def _merge_cubes(self):
+        '合并各日的聚合数据，保存到cubes.npz'
+        cubes = {name: [] for name in Vehicles.CUBES}
+        for day in sorted(self.manifest['days']):
+            day_cubes = self._load(self._day_file(day), list(cubes))
+            for name, cube in day_cubes.items():
+                cubes[name].append(cube)
+        self._save(self._path('cubes.npz'),
+                   {name: Vehicles.merge_cubes(name, parts)
+                    for name, parts in cubes.items()})
+
+    def load_cubes(self):
+        '返回所有数据的聚合数据(cube, plate_cube)，见Vehicles._build_cubes'
+        cubes = self._load(self._path('cubes.npz'))
+        return cubes['cube'], cubes['plate_cube']
+
+    def load_others(self):
+        '''返回dict{no_source:station为空的行（已去重）, malformed:出口时间无法识别的行}
+        '''
+        others = self._load(self._path('others.npz'))
+        no_source = others['no_source'].drop(columns='source')
+        return {'no_source': no_source.drop_duplicates(ignore_index=True),
+                'malformed': others['malformed'].drop(columns='source')}
+
+    def load_frame(self):
+        '读取所有日的行，各日去重后合并，即Vehicles.frame'
+        return Vehicles.concat_frames(
+            self._dedupe(self._load(self._day_file(day), ['rows'])['rows'])[0]
+            for day in sorted(self.manifest['days']))
+
+    @property
+    def nrows(self):
+        '所有已保存文件的原始行数'
+        return sum(saved['nrows'] for saved in self.manifest['files'].values())
+
+    @property
+    def exits(self):
+        '各文件中的[出口高速, 出口站名]，dict{文件:[[出口高速, 出口站名]]}'
+        return {path: saved['exits']
+                for path, saved in self.manifest['files'].items()}
+
+    @property
+    def date_gap(self):
+        '所有数据的起止时间'
+        days = self.manifest['days'].values()
+        begin = min(pd.Timestamp(day['begin']) for day in days)
+        end = max(pd.Timestamp(day['end']) for day in days)
+        return begin, end
+
+
+if __name__ == '__main__':
+    import sys
+    store = VehiclesStore()
+    print(store.add(sys.argv[1:]))
+    print(f'共{store.nrows}行，{len(store.manifest["days"])}天')
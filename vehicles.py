@@ -8,16 +8,33 @@
 '''
 
 
+import copy
 import numpy as np
 import pandas as pd
+from cache import FrameCache
+from concurrent.futures import ProcessPoolExecutor
 from d import D
-from datetime import datetime
-from decimal import Decimal
-from draw import Draw
+from draw import Renderer
 from filepath import filePath as fp
+from functools import partial, wraps
+from reader import StreamReader
 from timeit import default_timer as timer
 
 
+def memoized(method):
+    '''缓存Vehicles报告数据的方法或属性，相同参数只计算一次
+    结果保存在实例的_memo中，由Vehicles.invalidate()清除
+    每次返回结果的深拷贝，调用者修改返回值（如添加'fig'）不影响缓存
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self._memo:
+            self._memo[key] = method(self, *args, **kwargs)
+        return copy.deepcopy(self._memo[key])
+    return wrapper
+
+
 class Vehicles:
     '''车辆信息关系表，从Excel文件中获取渲染Word所需数据。
 
@@ -74,16 +91,30 @@ class Vehicles:
 代码结构：
 1._get_fee_by_group(self, frame, by)
     按不同分组by，获取frame中fee列的总和，及在frame中所有fee总和的占比
+    只做一次groupby求和，fee和per由各组总和用numpy整数运算得出，不逐组回调
     由此衍生出：
     _get_fee_by_mode->_fee_of_trucks, _fee_of_cars->fee_of_cars_vs_trucks
     fee_of_primary_out_provinces
     fee_of_primary_stations_3cats
     fee_of_stations
     fee_of_topmost_plates
-2.normalize_per(cls, per_col)
-    对per_col整列和为100的值进行调整，使四舍五入后的累加值为100
-3.get_primary_rows(cls, frame, key='per', pct=80, max_len=30)
+2._build_cubes(self)
+    数据清理后一次性分组，得到聚合数据：
+    _cube:按(mode, province, station)分组的通行费总和fee（分）和行数count
+    _plate_cube:按(mode, plate)分组的通行费总和和行数
+    所有报告数据都从这两个聚合数据中获取，不再逐次查询self.frame
+3.normalize_per(cls, fen, total=None)
+    由各组通行费（分）计算百分比，按最大余数法分配舍入误差，使累加值为100
+4.get_primary_rows(cls, frame, key='per', pct=80, max_len=30, by=None)
     所有获取主要部分数据的函数都调用此类方法
+5.memoized, invalidate(self)
+    报告数据（上面的复合数据）第一次获取时计算，之后从_memo中返回
+    primary_mode_threhold, topmost_plates_count改变时自动调用invalidate清除缓存
+6._figure(self, kind, df, fig_path)
+    数据计算只调用_figure登记图片，由_figure提交给draw.Renderer绘制，
+    图片按内容缓存，文件名含哈希值，数据未改变时直接使用已有图片
+    报告中的图片记录在figures中，wait_figures()等待并行绘制完成
+    redraw()只重新绘制图片，不重新计算数据
 
 命名约定：
 1.百分比：per, pct
@@ -94,43 +125,148 @@ class Vehicles:
 
 创建模块：
 1.d.py 对所有结果数值计算使用Python内置decimal模块，避免溢出
+  fee列在读取时一次性转换为以分为单位的int64，求和与占比用numpy整数运算，
+  结果与decimal一致
 2.file_util:自动创建文件夹，以及实现代码中只出现文件名，自动生成绝对路径。
+3.cache.py 按列缓存每个Excel文件清理后的数据，文件未改变时无需再次解析Excel
+4.reader.py 用openpyxl只读模式分块读取xlsx文件，每块读取后立即清理
+5.store.py 按日增量保存清理后的数据和聚合数据，新增文件时只读取新文件，
+  见from_store
+6.batch.py 按任务清单批量生成多个收费站、多个时期的报告，见__init__的period
 
 图片：
 处理数据时生成图片。目的，尝试将dataframe对象传递给seaborn做图
+图片按数据内容缓存在images文件夹，数据未改变时不重新绘制
 '''
 
-    def __init__(self, excel_files):
+    def __init__(self, excel_files, use_cache=True, workers=1,
+                 reader='stream', render_workers=1, render_profile='archive',
+                 render=True, period=None):
+        '''excel_files:Excel文件路径list
+        use_cache:是否使用清理后数据的缓存，见cache.FrameCache
+        workers:读取Excel文件的进程数，>1时多个文件并行读取
+        reader:'stream'用reader.StreamReader分块读取xlsx文件，
+               'pandas'用pandas.read_excel一次读取整个文件
+        render_workers:绘图进程数，>1时图片由进程池并行绘制，
+               使用图片前需调用wait_figures()，见draw.Renderer
+        render_profile:图片输出配置，'draft','print'或'archive'，见draw.Draw.PROFILES
+        render:False时只计算数据，不导入matplotlib，不绘制图片
+               fig_path仍为图片应保存的路径，需要时调用redraw()绘制
+        period:只统计该时期的数据，如'2021-12'，'2021Q4'，见pandas.Period
+               该时期内没有数据时抛出ValueError
+               默认统计所有数据，nrows_read仍为文件中的原始行数
+        '''
+        self._setup(render_workers, render_profile, render)
+
+        # 读取数据并清理
         begin = timer()
-        self.frame = self._read(excel_files)
+        self._frame = self._read(excel_files, use_cache, workers, reader,
+                                 period)
         end = timer()
-        self.nrows_read = self.frame.shape[0]
         self.time_spent = round(end-begin, 2)
-
-        self.station = 'XXX收费站'       # 出口站名
-        self.no_source_fee = 0.0  # 不明来源地的通行费
-        self.primary_mode_threhold = 25  # 主要车型通行费占比判别值
-        self.topmost_plates_count = 30   # 靠前车牌数量
-        # 数据清理
-        self.frame.drop_duplicates(inplace=True, ignore_index=True)
-        self._get_station(excel_files[0])
-        self._normalize_mode()
-        self._sum_no_source_fee()
-        self._add_province()
-        self._fillna_plate()
-        self._normalize_datetime()
-        self._reduce_memory_use()
+        self._check_station()
         # 最后获取精确总通行费，方便以后计算
         # 需在数据清理完成后获取：多次调用的数值
+        self._build_cubes()
+        self._date_gap = self._get_date_gap()
         self._total_fee = self._get_total_fee()
         self._primary_modes = self._get_primary_modes()
 
+    @classmethod
+    def from_store(cls, store, excel_files=(), workers=1, reader='stream',
+                   render_workers=1, render_profile='archive', render=True):
+        '''从store.VehiclesStore创建，不重新读取已保存的Excel文件
+        excel_files:新增的Excel文件，先清理后合并到store，已保存的文件自动跳过，
+                    保存后修改过的文件重新读取，替换原有的行
+        聚合数据，总通行费，无来源通行费和主要车型都由store中保存的各日汇总得出，
+        self.frame在第一次使用时才从store读取
+        其他参数见__init__
+        '''
+        vehicles = cls.__new__(cls)
+        vehicles._setup(render_workers, render_profile, render)
+
+        begin = timer()
+        store.add(excel_files, workers, reader)
+        vehicles._store = store
+        vehicles.nrows_read = store.nrows
+        vehicles.stations = {excel_file: [cls.get_station_name(*exit_)
+                                          for exit_ in exits]
+                             for excel_file, exits in store.exits.items()}
+        others = store.load_others()
+        vehicles.malformed_rows = others['malformed']
+        vehicles.no_source_fee = D(others['no_source']['fee']).sum()
+        vehicles._cube, vehicles._plate_cube = store.load_cubes()
+        vehicles._date_gap = store.date_gap
+        end = timer()
+        vehicles.time_spent = round(end-begin, 2)
+        vehicles._check_station()
+        vehicles._total_fee = vehicles._get_total_fee()
+        vehicles._primary_modes = vehicles._get_primary_modes()
+        return vehicles
+
+    def _setup(self, render_workers, render_profile, render):
+        '设置读取数据前的初始值'
+        self.station = 'XXX收费站'       # 出口站名
+        self.no_source_fee = 0.0  # 不明来源地的通行费
+        self._primary_mode_threhold = 25  # 主要车型通行费占比判别值
+        self._topmost_plates_count = 30   # 靠前车牌数量
+        self.nrows_read = 0              # 读取的原始数据行数
+        self.stations = {}               # 各文件中的收费站{文件:[收费站名称]}
+        self.malformed_rows = None       # 出口时间无法识别，未计入统计的行
+        self.duplicate_rows = {}         # 各文件中与之前读取的行重复，未计入的行数{文件:行数}
+        self.figures = {}                # 报告中的图片{图片路径:(Draw方法名, df, 不含哈希值的路径)}
+        self._memo = {}                  # 报告数据缓存，见memoized
+        self.renderer = Renderer(render_workers, render_profile)  # 绘图任务队列
+        self.render = render             # 是否绘制图片
+        self._frame = None               # 清理后的数据，见frame
+        self._store = None               # from_store创建时的store.VehiclesStore
+
+    HEADER = 3                  # Excel表头所在行
+    COLUMNS = {'出口车牌号': 'plate',
+               '出口时间': 'datetime',
+               '入口站名': 'station',
+               '出口车型': 'mode',
+               '通行费金额': 'fee',
+               '车辆总轴数': 'axis',
+               }
+    EXIT_COLUMNS = ['出口高速', '出口站名']  # 用于获取所在收费站，读取时取出
+    # 车型调整规则，按顺序执行，条件中的mode为前面规则调整后的车型
+    # (列名, numpy比较函数名, 比较值, 调整方式, 调整值)
+    # 调整方式：'add'车型加上调整值，'set'车型设为调整值
+    MODE_RULES = [
+        ('mode', 'greater_equal', 21, 'add', -10),  # 专项作业车按同轴型货车计算
+        ('axis', 'equal', 6, 'set', 16),            # 六轴货车三类按六类计算
+    ]
     DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    # select_top每次部分排序的初始行数，累加值不够时增加到4倍
+    TOP_CHUNK = 32
+    # 判断重复行的关键列，province由station得出，无需比较
+    DEDUP_KEY = ['plate', 'datetime', 'station', 'mode', 'fee']
+    # 清理后self.frame的列和数据类型
+    # category类型为整数编码+字符串表，每个不同的车牌，收费站名称只保存一次
+    SCHEMA = {
+        'plate': 'category',            # 车牌
+        'datetime': 'datetime64[s]',    # 出口时间，精确到秒
+        'station': 'category',          # 入口站名
+        'mode': np.uint8,               # 车型代码，见MODES
+        'fee': np.int64,                # 通行费，单位分
+        'province': np.uint8,           # 入口站省份代码，见PROVINCES
+    }
+    # 压缩前的数据类型，仅用于memory_report比较
+    LEGACY_SCHEMA = {
+        'plate': object,
+        'datetime': 'datetime64[ns]',
+        'station': object,
+        'mode': np.uint8,
+        'fee': object,                  # 通行费字符串，如'12.5'
+        'province': np.uint8,
+    }
     PROVINCES = ['四川', '贵州', '云南', '陕西', '甘肃', '青海', '台湾', '内蒙古',
                  '广西', '西藏', '宁夏', '新疆', '北京', '天津', '上海', '重庆',
                  '河北', '山西', '辽宁', '吉林', '黑龙江', '江苏', '浙江', '安徽',
                  '福建', '江西', '山东', '河南', '湖北', '湖南', '广东', '海南',
                  '香港', '澳门']
+    PROVINCE_CODES = {p: i for i, p in enumerate(PROVINCES)}  # 省份名称:代码
     MODES = {1: "一类客车", 2: "二类客车", 3: "三类客车", 4: "四类客车",
              11: "一类货车", 12: "二类货车", 13: "三类货车", 14: "四类货车",
              15: "五类货车", 16: "六类货车"}
@@ -146,7 +282,7 @@ class Vehicles:
     @classmethod
     def encode_province(cls, province_str):
         '将省份名字转换为数值'
-        return cls.PROVINCES.index(province_str)
+        return cls.PROVINCE_CODES[province_str]
 
     @classmethod
     def decode_mode(cls, code, simplified=True):
@@ -157,40 +293,43 @@ class Vehicles:
         return decoded
 
     @classmethod
-    def normalize_per(cls, per_col):
-        '''
-        将Series对象per_col中的数（百分比）正常化：
-        即所有值相加等于100,若不等于100,用最大值减去差值
-        先将per_col数据类型转换为np.str_方便使用D.sum()
-        返回时再转换为np.float32类型
-        为使用Series.idmax方法，需提前获取最大值索引和数值
-        '''
-        # 获取最大百分比位置，和数值
-        idx_max = per_col.argmax()
-        value_max = per_col[idx_max]
-
-        per_col = per_col.copy().astype(np.str_)
-        total = D(per_col).sum()
-        diff = D.minus(total, 100)
-        # print(f'total={total}, diff={diff}, max={value_max}')
-        if diff == Decimal('0'):
-            return per_col.map(lambda p: float(Decimal(p)))
-        # 用最大百分比减去差值
-        per_col[idx_max] = str(D.minus(value_max, diff))
-        return per_col.map(float)
+    def normalize_per(cls, fen, total=None):
+        '''
+        以分为单位的各组通行费fen占total的百分比（保留两位小数），
+        并使其和等于各组总和占比四舍五入后的值，total为各组总和（默认）时即为100
+        按最大余数法(Hamilton)分配：
+        1.以万分比整数计算，各组先取fen*10000/total的整数部分
+        2.与目标万分比的差额k，依次加给余数最大的k个组，每组加1，
+          余数相同时按原顺序，结果稳定
+        整列用numpy整数运算，组数很多（如按车牌）时结果仍精确
+        返回np.float64数组
+        '''
+        fen = np.asarray(fen, dtype=np.int64)
+        if total is None:
+            total = fen.sum()
+        total = int(total)
+        quotas, remainders = np.divmod(fen * 10000, total)
+        target = D.round_half_up(fen.sum() * 10000, total)
+        k = int(target - quotas.sum())
+        if k > 0:
+            quotas[np.argsort(-remainders, kind='stable')[:k]] += 1
+        return quotas / 100
 
     @classmethod
-    def get_primary_rows(cls, frame, key='per', pct=60, max_len=30):
+    def get_primary_rows(cls, frame, key='per', pct=60, max_len=30, by=None):
         '''
         frame:DataFrame对象，无需按key值从大到小排序，此函数排序
         key:frame中需操作的列名，数值为百分比，如89, 20, 22.4
+        by:排序的列名，默认为key。key四舍五入后可能相同，
+           用各组通行费（分，见_get_fee_by_group的fen）排序才能保留通行费多的行，
+           百分比由通行费得出，顺序一致，累加的仍为key列
         pct:需获共取占多少比值的行。<100，否则调用此函数无意义
         max_len:如果到达max_len行还没有pct百分比，则返回前max_len行数据
 
         返回数据类型：{data: 截取后的frame, fee:截取后的总通行费，per:截取后的总占比}
 
-        1.如果frame的行数<=max_len,直接返回
-        2.获取对frame按key进行降序排列，key列逐行累加
+        1.如果frame的行数<=max_len,排序后直接返回
+        2.获取对frame按by进行降序排列（值相同时按原顺序），key列逐行累加
         3.获取第一个>=pct值行的位置
         如果行数<=max_len，则成功获取并返回
         如果>max_len, 则返回max_len行数据
@@ -206,26 +345,51 @@ class Vehicles:
 
         pandas.Series.iloc:截取时超出边界也不报错。！！白思考了。
         '''
-        # 降序排序
-        sorted_df = frame.sort_values(
-            by=key, ascending=False, ignore_index=True)
+        # 只部分排序前面的行，见select_top
+        positions = cls.select_top(frame[by or key].to_numpy(), max_len, pct,
+                                   frame[key].to_numpy())
+        return frame.iloc[positions].reset_index(drop=True)
 
-        nrows = frame.shape[0]
-        # print(f'数据长度={nrows}')
-        if nrows <= max_len:
-            return sorted_df
-
-        per_col = sorted_df[key]
-        # print(f'累加前：\n{per_col}')
-        # 获取表示百分比的列,并累加
-        cumsum_col = per_col.cumsum()
-        # print(f'累加后：\n{cumsum_col}')
-        # 定位满足大于百分比pct的行位置
-        bigger_idx = cumsum_col.loc[cumsum_col >= pct].index[0]
+    @classmethod
+    def top_positions(cls, values, k):
+        '''数组values中最大的k个值的位置，按值降序，值相同时按位置升序
+        argpartition只找出k个最大值，不对整个数组排序，再对这k个排序
+        与第k大值相同的值不止一个时，取位置靠前的，结果与稳定排序一致
+        '''
+        if k >= values.shape[0]:
+            candidates = np.arange(values.shape[0])
+        else:
+            top = np.argpartition(-values, k-1)[:k]
+            threshold = values[top].min()
+            above = np.flatnonzero(values > threshold)
+            equal = np.flatnonzero(values == threshold)[:k-above.shape[0]]
+            candidates = np.concatenate([above, equal])
+        return candidates[np.lexsort((candidates, -values[candidates]))]
 
-        if bigger_idx + 1 > max_len:
-            return sorted_df.iloc[:max_len]
-        return sorted_df.iloc[:bigger_idx+1]
+    @classmethod
+    def select_top(cls, values, max_len, pct=None, shares=None):
+        '''按值降序选取数组values中前面的行，返回位置数组，值相同时按原顺序
+        1.行数<=max_len时返回所有行
+        2.否则按此顺序累加shares（默认为values），到第一个>=pct的行为止，
+          最多max_len行，pct为None时直接返回前max_len行
+        先部分排序前TOP_CHUNK行，累加值不够pct时增加到4倍，直到max_len行，
+        主要部分通常只有前几行，无需对所有行排序
+        '''
+        nrows = values.shape[0]
+        if shares is None:
+            shares = values
+        if nrows <= max_len:
+            return cls.top_positions(values, nrows)
+        k = min(cls.TOP_CHUNK, max_len)
+        while True:
+            top = cls.top_positions(values, k)
+            if pct is not None:
+                reached = np.flatnonzero(np.cumsum(shares[top]) >= pct)
+                if reached.shape[0]:
+                    return top[:min(reached[0]+1, max_len)]
+            if k == max_len:
+                return top
+            k = min(k*4, max_len)
 
     @classmethod
     def get_tuple_or_single_param(cls, param):
@@ -237,95 +401,300 @@ class Vehicles:
             return param
         return (param, param)
 
-    def _read(self, excel_files):
+    def _read(self, excel_files, use_cache=True, workers=1, reader='stream',
+              period=None):
         '''从多个excel文件中读取数据
 操作顺序:
-1.从多个excel文件中读取数据
-2.从新读取第一个excel文件的第一行，获取当前收费站
-3.通过axis和mode两列合理化mode，删除axis列
-4.去除fee为空和fee为0的行
-5.获取station为空的行，统计这些行的所有通行费
-6.通过station获取入口站省份
-7.将车牌栏为空的填写为WPKXXXX
-8.将出口时间转换为pandas的datetime对象
-9.转换数据类型，降低内存消耗
+1.逐个读取excel文件并清理，见_load_excel。
+  use_cache时，优先读取缓存，未缓存或缓存失效的文件读取后写入缓存
+  workers>1时，未缓存的文件由多个进程并行读取，合并顺序与excel_files一致
+2.合并所有文件数据，按指纹去除重复行（包括不同文件之间的），见dedupe
+  统计每个文件中被去除的行数
+3.指定period时，只保留出口时间在该时期的行，见_in_period
+4.统计station为空的行的所有通行费
 '''
-        header = 3
-        col_rename = {'出口车牌号': 'plate',
-                      '出口时间': 'datetime',
-                      '入口站名': 'station',
-                      '出口车型': 'mode',
-                      '通行费金额': 'fee',
-                      '车辆总轴数': 'axis',
-                      }
-
-        usecols = col_rename.keys()
-        engine = 'openpyxl'
-        frames = []
+        cache = FrameCache() if use_cache else None
+        packs = {}
+        if cache:
+            for excel_file in excel_files:
+                packed = cache.load(excel_file)
+                if packed is not None:
+                    packs[excel_file] = packed
+        missing = [f for f in excel_files if f not in packs]
+        for excel_file, packed in zip(missing,
+                                      self._load_excel_files(missing, workers,
+                                                             reader)):
+            packs[excel_file] = packed
+            if cache:
+                cache.save(excel_file, packed)
+
+        parts = {}
         for excel_file in excel_files:
             print(excel_file)
-            frame = pd.read_excel(excel_file,
-                                  names=None,  # 读取所有sheets
-                                  header=header,
-                                  usecols=usecols,
-                                  dtype={'通行费金额': np.str_}  # 方便使用decimal
-                                  # engine=engine
-                                  )
-
-            frames.append(frame)
-
-        frame = pd.concat(frames, ignore_index=True)
-        frame.rename(columns=col_rename, inplace=True)
+            file_frames, meta = FrameCache.unpack(packs[excel_file])
+            for name, file_frame in file_frames.items():
+                parts.setdefault(name, []).append(file_frame)
+            nrows_malformed = file_frames['malformed'].shape[0]
+            if nrows_malformed:
+                print(f'{excel_file}：{nrows_malformed}行出口时间无法识别，未计入统计')
+            self.nrows_read += meta['nrows']
+            self.stations[excel_file] = [self.get_station_name(*exit_)
+                                         for exit_ in meta['exits']]
+
+        frame, duplicates = self.dedupe(parts['frame'])
+        for excel_file, count in zip(excel_files, duplicates):
+            self.duplicate_rows[excel_file] = int(count)
+            if count:
+                print(f'{excel_file}：{count}行与已读取的行重复，未重复计入')
+        no_source = self.concat_frames(parts['no_source'])
+        no_source.drop_duplicates(inplace=True, ignore_index=True)
+        if period is not None:
+            in_period = self._in_period(frame['datetime'], period)
+            if not in_period.any():
+                # 没有数据时各项占比，日期均无意义，不生成报告
+                raise ValueError(f'{period}内没有数据')
+            if not in_period.all():
+                print(f'{period}以外的{(~in_period).sum()}行未计入统计')
+            frame = frame[in_period].reset_index(drop=True)
+            # station为空的行出口时间未经转换，无法识别的不计入
+            no_source_datetime = pd.to_datetime(no_source['datetime'],
+                                                format=self.DATETIME_FORMAT,
+                                                errors='coerce')
+            no_source = no_source[self._in_period(no_source_datetime, period)]
+        self.malformed_rows = self.concat_frames(parts['malformed'])
+        self.no_source_fee = D(no_source['fee']).sum()
         return frame
 
-    def _get_station(self, excel_file):
-        '获取所在收费站'
-        usecols = ['出口高速', '出口站名']
-        nrows = 1
-        header = 3
+    @classmethod
+    def fingerprint(cls, frame):
+        '''每行关键列(DEDUP_KEY)的64位指纹，返回uint64数组
+        category列按整数编码计算，不再逐个计算字符串的哈希值，
+        因此指纹只在同一frame内可比较
+        '''
+        key = {}
+        for col in cls.DEDUP_KEY:
+            column = frame[col]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.cat.codes
+            key[col] = column
+        return pd.util.hash_pandas_object(pd.DataFrame(key),
+                                          index=False).to_numpy()
+
+    @classmethod
+    def duplicated(cls, frame):
+        '''每行是否与之前的行重复，同DataFrame.duplicated()，只比较指纹
+        返回bool数组
+        '''
+        return pd.Series(cls.fingerprint(frame)).duplicated().to_numpy()
+
+    @classmethod
+    def dedupe(cls, frames):
+        '''合并多个frame，并去除重复行，保留最先出现的
+        只比较每行的64位指纹，不逐列比较，不同的行指纹相同的概率可忽略
+        返回(合并后的frame, 每个frame中被去除的行数数组)
+        '''
+        frames = list(frames)
+        source = np.repeat(np.arange(len(frames)),
+                           [frame.shape[0] for frame in frames])
+        frame = cls.concat_frames(frames)
+        duplicated = cls.duplicated(frame)
+        counts = np.bincount(source[duplicated], minlength=len(frames))
+        if counts.any():
+            frame = frame[~duplicated].reset_index(drop=True)
+        return frame, counts
+
+    @classmethod
+    def _in_period(cls, datetimes, period):
+        '''datetimes中每个出口时间是否在period时期内
+        period:pandas.Period或可转换的字符串，如'2021-12'
+        '''
+        period = pd.Period(period)
+        return (datetimes >= period.start_time) & (datetimes <= period.end_time)
+
+    @classmethod
+    def _load_excel_files(cls, excel_files, workers=1, reader='stream'):
+        '''读取并清理多个excel文件，按excel_files的顺序逐个返回FrameCache.pack()的结果
+        workers>1时使用进程池，每个进程读取一个文件，
+        进程间只传递压缩后的numpy数组，而非object类型的DataFrame
+        '''
+        load = partial(cls._load_excel_packed, reader=reader)
+        if workers > 1 and len(excel_files) > 1:
+            workers = min(workers, len(excel_files))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                yield from executor.map(load, excel_files)
+        else:
+            yield from map(load, excel_files)
+
+    @classmethod
+    def _load_excel_packed(cls, excel_file, reader='stream'):
+        '读取并清理单个excel文件，返回FrameCache.pack()的结果'
+        return FrameCache.pack(*cls._load_excel(excel_file, reader))
+
+    @classmethod
+    def _load_excel(cls, excel_file, reader='stream'):
+        '''读取并清理单个excel文件
+reader为'stream'且文件为xlsx时，用StreamReader分块读取，每块读取后立即清理，
+内存占用只与分块大小有关。否则用pandas.read_excel读取整个文件后清理。
+重复行在合并所有文件后统一去除。
+
+读取时同时获取文件中所有不同的[出口高速, 出口站名]，用于判断所在收费站
+
+返回({'frame':清理后的数据, 'no_source':station为空的行,
+      'malformed':出口时间无法识别的行},
+     {'nrows':原始行数, 'exits':[[出口高速, 出口站名]]})
+'''
+        columns = list(cls.COLUMNS) + cls.EXIT_COLUMNS
+        if reader == 'stream' and StreamReader.supports(excel_file):
+            stream = StreamReader(excel_file,
+                                  header=cls.HEADER,
+                                  columns=columns,
+                                  str_columns=['通行费金额'])
+            chunks = stream.chunks()
+        else:
+            chunks = [cls._read_excel(excel_file)]
+
+        nrows = 0
+        exits = []
+        parts = {'frame': [], 'no_source': [], 'malformed': []}
+        for chunk in chunks:
+            exit_rows = chunk[cls.EXIT_COLUMNS].dropna().drop_duplicates()
+            for exit_ in exit_rows.itertuples(index=False):
+                if list(exit_) not in exits:
+                    exits.append(list(exit_))
+            chunk = chunk.drop(columns=cls.EXIT_COLUMNS)
+            chunk.rename(columns=cls.COLUMNS, inplace=True)
+            nrows += chunk.shape[0]
+            frame, others = cls._clean(chunk)
+            parts['frame'].append(frame)
+            for name, rows in others.items():
+                parts[name].append(rows)
+        frames = {name: cls.concat_frames(part)
+                  for name, part in parts.items()}
+        return frames, {'nrows': nrows, 'exits': exits}
+
+    @classmethod
+    def _clean(cls, frame):
+        '''清理从excel文件中读取的数据
+操作顺序:
+1.通过axis和mode两列合理化mode，删除axis列
+2.去除fee为空和fee为0的行，分离station为空的行
+3.通过station获取入口站省份
+4.将车牌栏为空的填写为WPKXXXX
+5.将出口时间转换为pandas的datetime对象，分离无法识别的行
+6.转换数据类型，降低内存消耗
+
+返回(清理后的数据, {'no_source':station为空的行, 'malformed':出口时间无法识别的行})
+'''
+        cls._normalize_mode(frame)
+        frame, no_source = cls._sum_no_source_fee(frame)
+        cls._add_province(frame)
+        cls._fillna_plate(frame)
+        malformed = cls._normalize_datetime(frame)
+        frame = cls._reduce_memory_use(frame)
+        return frame, {'no_source': no_source, 'malformed': malformed}
+
+    @classmethod
+    def _read_excel(cls, excel_file):
+        '从单个excel文件中读取数据'
+        engine = 'openpyxl'
         frame = pd.read_excel(excel_file,
-                              header=header,
-                              usecols=usecols,
-                              nrows=nrows
+                              names=None,  # 读取所有sheets
+                              header=cls.HEADER,
+                              usecols=list(cls.COLUMNS) + cls.EXIT_COLUMNS,
+                              dtype={'通行费金额': np.str_}  # 方便使用decimal
+                              # engine=engine
                               )
-        read = frame.to_dict('records')[0]
-        the_way, station = read[usecols[0]], read[usecols[1]]
+        frame.rename(columns=cls.COLUMNS, inplace=True)
+        return frame
+
+    @classmethod
+    def get_station_name(cls, the_way, station):
+        '由出口高速和出口站名获取收费站名称'
         prefix = the_way[:-2]
-        self.station = station.removeprefix(prefix) + '收费站'
+        return station.removeprefix(prefix) + '收费站'
 
-    def _normalize_mode(self):
+    @property
+    def station_names(self):
+        '所有文件中不同的收费站名称，按读取顺序'
+        names = []
+        for file_names in self.stations.values():
+            for name in file_names:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def _check_station(self):
+        '''获取所在收费站，即第一个文件第一行数据的收费站
+        所有文件应为同一收费站，否则给出提示
         '''
+        names = self.station_names
+        if names:
+            self.station = names[0]
+        if len(names) > 1:
+            print(f'注意：数据中包含多个收费站：{"，".join(names)}，'
+                  f'报告中使用{self.station}')
+
+    @classmethod
+    def _normalize_mode(cls, frame):
+        '''按MODE_RULES调整车型，删除axis列
         1.六轴货车三类按六类计算
         2。专项作业车按同轴型货车计算
+        每条规则对整列用np.where计算，不逐行处理
         '''
-        frame = self.frame
-        frame['mode'] = frame['mode'].apply(
-            lambda m: m-10 if m >= 21 else m)
-        frame['mode'] = frame[['axis', 'mode']].apply(
-            lambda x: 16 if x['axis'] == 6 else x['mode'], axis='columns')
+        mode = frame['mode'].to_numpy()
+        for column, compare, value, action, amount in cls.MODE_RULES:
+            col = mode if column == 'mode' else frame[column].to_numpy()
+            mask = getattr(np, compare)(col, value)
+            adjusted = mode + amount if action == 'add' else amount
+            mode = np.where(mask, adjusted, mode)
+        frame['mode'] = mode
         frame.drop('axis', axis='columns', inplace=True)
 
-    def _sum_no_source_fee(self):
-        '''统计没有入口站信息的费用
-        并删除该行
+    @classmethod
+    def _sum_no_source_fee(cls, frame):
+        '''分离没有入口站信息的行，以便统计费用
         依赖于先取出fee值非法的行，所以不单独定义函数
+        返回(有入口站信息的frame, 没有入口站信息的行)
         '''
         def is_digit(fee_series):
             return fee_series.str.replace('.', '1', 1, regex=False).str.isdigit()
 
         # 去除fee为空和fee为0的行或不为数字的非法行
-        frame = self.frame
         fee = frame['fee']
         i = frame[(fee.isna()) | ~(is_digit(fee)) | (fee <= '0.0')].index
         frame.drop(i, axis='index', inplace=True)
 
-        # 获取station为空行的通行费总和
+        # 转换为以分为单位的整数，之后所有求和都是整数运算
+        frame['fee'] = D.to_fen(frame['fee'])
+
+        # 分离station为空的行，合并所有文件并去重后再统计通行费总和
         rows = frame.loc[frame['station'].isna()]
-        self.no_source_fee = D(rows['fee']).sum()
         frame.drop(rows.index, axis='index', inplace=True)
+        return frame, rows.drop(columns='station')
 
-    def _add_province(self):
+    @classmethod
+    def concat_frames(cls, frames):
+        '''合并多个DataFrame
+        各frame中category列的类别可能不同，先统一为所有类别的并集（排序后），
+        使合并后仍为category类型
+        '''
+        frames = list(frames)
+        for col in frames[0].columns:
+            if not isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+                continue
+            # 一次去重后排序，不逐个求并集
+            categories = pd.Index(pd.unique(np.concatenate(
+                [frame[col].cat.categories.to_numpy() for frame in frames])))
+            categories = categories.sort_values()
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)})
+                      for frame in frames]
+        return pd.concat(frames, ignore_index=True)
+
+    @classmethod
+    def _add_province(cls, frame):
         '''添加入口站省份
+        station转换为category类型，每个不同的收费站只计算一次省份，
+        再通过category的编码得到每行的省份
         '''
         def slice_province(s):
             '截取入口收费站省份'
@@ -333,44 +702,100 @@ class Vehicles:
             province = s[:2]
             if province in special_provinces:
                 province = s[:3]
-            return self.encode_province(province)
+            return cls.encode_province(province)
 
-        self.frame['province'] = self.frame['station'].apply(
-            slice_province)
+        station = frame['station'].astype('category')
+        provinces = np.array([slice_province(s) for s in station.cat.categories],
+                             dtype=np.uint8)
+        frame['station'] = station
+        frame['province'] = provinces[station.cat.codes.to_numpy()]
 
-    def _fillna_plate(self):
+    @classmethod
+    def _fillna_plate(cls, frame):
         '将车牌栏为空的填写为WPKXXXX'
-        self.frame['plate'].fillna(value='WPKXXXX', inplace=True)
-
-    def _normalize_datetime(self):
-        '将单元格中提取时间字符串合法化,是否有必要？'
-        def normalize(d_str):
-            datetime_format = self.DATETIME_FORMAT
-            dtime = datetime.strptime(d_str, datetime_format)
-            return datetime.strftime(dtime, datetime_format)
-        destination_datetime = self.frame['datetime']
-        self.frame['datetime'] = destination_datetime.apply(
-            normalize)
-
-    def _reduce_memory_use(self):
-        '''整理数据类型，减小内存使用
-        '''
-        # print(self.frame.info())
+        frame['plate'] = frame['plate'].fillna(value='WPKXXXX')
+
+    @classmethod
+    def _normalize_datetime(cls, frame):
+        '''将出口时间转换为datetime64
+        字符串按DATETIME_FORMAT一次性向量化解析，Excel中的日期单元格保持原值
+        无法识别的行从frame中删除，返回这些行（出口时间为原字符串）
+        '''
+        values = frame['datetime']
+        if pd.api.types.is_datetime64_any_dtype(values):
+            parsed = values
+        else:
+            if values.dtype == object:
+                is_str = values.str.len().notna()
+            else:
+                is_str = pd.Series(False, index=values.index)
+            parsed = pd.to_datetime(values.where(is_str),
+                                    format=cls.DATETIME_FORMAT,
+                                    errors='coerce')
+            native = ~is_str & values.notna()
+            if native.any():
+                parsed[native] = pd.to_datetime(values[native], errors='coerce')
+
+        malformed = parsed.isna()
+        rows = frame.loc[malformed].assign(
+            datetime=values[malformed].astype(str))
+        frame.drop(rows.index, axis='index', inplace=True)
+        frame['datetime'] = parsed[~malformed]
+        return rows
+
+    @classmethod
+    def _reduce_memory_use(cls, frame):
+        '''整理数据类型，减小内存使用，见SCHEMA
+        '''
+        # print(frame.info())
         # print('=================')
-        self.frame = self.frame.astype({
-            'plate': str,
-            'datetime': np.datetime64,
-            'station': str,
-            'province': np.uint8,
-            # 'fee': np.str_,
-            'mode': np.uint8
-        })
-        # print(self.frame.info())
+        return frame.astype(cls.SCHEMA)
     # 获取数据
 
+    @property
+    def frame(self):
+        '''清理后的所有数据
+        from_store创建时，第一次使用才从store读取所有行
+        '''
+        if self._frame is None and self._store is not None:
+            self._frame = self._store.load_frame()
+        return self._frame
+
+    CUBES = {'cube': ['mode', 'province', 'station'],
+             'plate_cube': ['mode', 'plate']}  # 聚合数据的分组列
+
+    def _build_cubes(self):
+        '''对清理后的数据分组，得到报告所需的聚合数据
+        _cube:(mode, province, station)，_plate_cube:(mode, plate)
+        列fee为通行费总和（分），count为行数
+        '''
+        cubes = self.aggregate(self.frame)
+        self._cube, self._plate_cube = cubes['cube'], cubes['plate_cube']
+
+    @classmethod
+    def aggregate(cls, frame):
+        '''按CUBES对清理后的数据分组求和
+        返回dict{名称:聚合数据}，列fee为通行费总和（分），count为行数
+        '''
+        cubes = {}
+        for name, by in cls.CUBES.items():
+            grouped = frame.groupby(by, sort=True, observed=True)['fee']
+            result = grouped.agg(['sum', 'size']).reset_index()
+            cubes[name] = result.rename(columns={'sum': 'fee', 'size': 'count'})
+        return cubes
+
+    @classmethod
+    def merge_cubes(cls, name, cubes):
+        '''合并多个aggregate()得到的同名聚合数据，如各日的聚合数据
+        同一分组的fee和count相加，结果与对所有行aggregate()相同
+        '''
+        cube = cls.concat_frames(cubes)
+        grouped = cube.groupby(cls.CUBES[name], sort=True, observed=True)
+        return grouped[['fee', 'count']].sum().reset_index()
+
     def _get_total_fee(self):
-        '获取精确的总通行费'
-        return D(self.frame['fee']).sum()
+        '获取精确的总通行费，单位分'
+        return D(self._cube['fee']).fen()
 
     @ property
     def total_fee(self):
@@ -379,11 +804,11 @@ class Vehicles:
         将属性._total_fee修改
 
         '''
-        total_fee = self._total_fee
+        total_fee = D.from_fen(self._total_fee)
         return D.round(D.scale(total_fee))
 
     def _get_date_gap(self):
-        '''获取数据总天数
+        '''获取数据的起止时间，初始化时获取一次，保存在_date_gap
         '''
         frame = self.frame
         begin = frame['datetime'].min()
@@ -393,7 +818,7 @@ class Vehicles:
     @ property
     def month_gap(self):
         '返回描述年月跨度的字符串'
-        begin, end = self._get_date_gap()
+        begin, end = self._date_gap
         year_from = begin.year
         month_from = begin.month
         year_to = end.year
@@ -411,35 +836,33 @@ class Vehicles:
     @ property
     def daily_fee(self):
         '获取日均通行费'
-        begin, end = self._get_date_gap()
+        begin, end = self._date_gap
         total_days = (end - begin).days + 1
-        dresult = D.divide(self._total_fee, total_days)
+        dresult = D.divide(D.from_fen(self._total_fee), total_days)
         dresult = D.scale(dresult)
         dresult = D.round(dresult)
         return float(dresult)
 
     @ property
+    @ memoized
     def fee_of_all_modes(self):
         df, fig_path = self._get_fee_by_mode((1, 16))
 
-        Draw(df, fig_path).for_all_modes()
+        fig_path = self._figure('for_all_modes', df, fig_path)
 
         return {'rows': df.to_dict('records'),
                 'fig_path': fig_path}
 
     @property
+    @memoized
     def fee_of_cars_and_trucks(self):
         # 获取客车货车总通行费和总占比Dataframe
-        df = self.frame[['mode', 'fee']]
-        mode_col = df['mode']
-        grouped = df.groupby((mode_col <= 4) & (mode_col >= 1), as_index=False)
-        cars_vs_trucks_df = grouped.agg(
-            mode=('mode', lambda x: '客车' if x.max() <= 4 else '货车'),
-            fee=('fee', lambda x: D(x).sum(scale=True, rounding=True)),
-            per=('fee', lambda x: D(x).per(self._total_fee)))
-
-        cars_vs_trucks_df['per'] = self.normalize_per(
-            cars_vs_trucks_df['per'])
+        mode_col = self._cube['mode']
+        is_car = ((mode_col <= 4) & (mode_col >= 1)).rename('mode')
+        cars_vs_trucks_df = self._get_fee_by_group(
+            self._cube, is_car, total_fee=self._total_fee)
+        cars_vs_trucks_df['mode'] = cars_vs_trucks_df['mode'].map(
+            {True: '客车', False: '货车'})
         # 添加客车货车详细信息
         records = cars_vs_trucks_df.to_dict('records')
         for record in records:
@@ -456,14 +879,14 @@ class Vehicles:
 
     def _fee_of_cars(self):
         df, fig_path = self._get_fee_by_mode((1, 4))
-        Draw(df, fig_path).for_cars_and_trucks()
+        fig_path = self._figure('for_cars_and_trucks', df, fig_path)
 
         return {'rows': df.to_dict('records'),
                 'fig_path': fig_path}
 
     def _fee_of_trucks(self):
         df, fig_path = self._get_fee_by_mode((11, 16))
-        Draw(df, fig_path).for_cars_and_trucks()
+        fig_path = self._figure('for_cars_and_trucks', df, fig_path)
         rows = list(df.itertuples(index=False))
         return {'rows': df.to_dict('records'),
                 'fig_path': fig_path}
@@ -474,7 +897,7 @@ class Vehicles:
         '''
         min_mode, max_mode = mode
         query = f'(mode >= {min_mode}) & (mode <= {max_mode})'
-        df = self.frame.query(query)
+        df = self._cube.query(query)
         df = self._get_fee_by_group(df, 'mode')
         df['mode'] = df['mode'].map(self.decode_mode)
         fig_path = fp(
@@ -486,10 +909,11 @@ class Vehicles:
     def count_of_all_provinces(self):
         return self.provinces_count()
 
+    @memoized
     def provinces_count(self, mode=(1, 16)):
         '获取所有省份个数'
         mode_min, mode_max = self.get_tuple_or_single_param(mode)
-        province_col = self.frame.query(
+        province_col = self._cube.query(
             f'(mode >= {mode_min} & (mode <= {mode_max}))')['province']
         return province_col.nunique()
 
@@ -497,21 +921,19 @@ class Vehicles:
     def fee_of_in_vs_out_province_all_modes(self):
         return self.fee_of_in_vs_out_provinces()
 
+    @memoized
     def fee_of_in_vs_out_provinces(self, mode=(1, 16)):
         mode_min, mode_max = self.get_tuple_or_single_param(mode)
-        df = self.frame[['province', 'fee', 'mode']].query(
+        df = self._cube[['province', 'fee', 'mode']].query(
             f'(mode >= {mode_min}) & (mode <= {mode_max})')
-        df = df[['province', 'fee']]
-        grouped = df.groupby((df['province'] == 0), as_index=False)
-        in_vs_out_df = grouped.agg(
-            province=('province', lambda x: '省内' if x.max() == 0 else '省外'),
-            fee=('fee', lambda x: D(x).sum(scale=True, rounding=True)),
-            per=('fee', lambda x: D(x).per(self._total_fee))
-        )
-        in_vs_out_df['per'] = self.normalize_per(in_vs_out_df['per'])
+        is_in = (df['province'] == 0).rename('province')
+        # 占比为所选车型通行费中的省内外比例，与其他分车型数据一致
+        in_vs_out_df = self._get_fee_by_group(df, is_in)
+        in_vs_out_df['province'] = in_vs_out_df['province'].map(
+            {True: '省内', False: '省外'})
 
         fig_path = fp(f'fee_in_vs_out_{mode_min}_{mode_max}.png').as_image_file
-        Draw(in_vs_out_df, fig_path).for_in_vs_out()
+        fig_path = self._figure('for_in_vs_out', in_vs_out_df, fig_path)
 
         return {'fig_path': fig_path,
                 'rows':     in_vs_out_df.to_dict('records')
@@ -521,17 +943,18 @@ class Vehicles:
     def fee_of_primary_out_provinces_all_modes(self):
         return self.fee_of_primary_out_provinces()
 
+    @memoized
     def fee_of_primary_out_provinces(self, mode=(1, 16)):
         mode_min, mode_max = self.get_tuple_or_single_param(mode)
-        df = self.frame[['province', 'fee', 'mode']].query(
+        df = self._cube[['province', 'fee', 'mode']].query(
             f'(mode >= {mode_min}) & (mode <= {mode_max}) & (province > 0)'
         )
         df = df[['province', 'fee']]
         # 所有省份通行费和占比
-        provinces_fee_df = self._get_fee_by_group(df, 'province')
-        # 获取主要外省省份
+        provinces_fee_df = self._get_fee_by_group(df, 'province', fen=True)
+        # 获取主要外省省份，按通行费（分）排序
         primary_df = self.get_primary_rows(
-            provinces_fee_df, pct=70, max_len=10)
+            provinces_fee_df, pct=70, max_len=10, by='fen').drop(columns='fen')
 
         # decode省份名称
         primary_df['province'] = primary_df['province'].map(
@@ -540,7 +963,7 @@ class Vehicles:
         # 做图
         fig_path = fp(
             f'fee_of_primary_out_provinces_mode_{mode_min}_{mode_max}.png').as_image_file
-        Draw(primary_df, fig_path).for_primary()
+        fig_path = self._figure('for_primary', primary_df, fig_path)
 
         return {'count': primary_df.shape[0],
                 'fee': D(primary_df['fee']).sum(),
@@ -561,6 +984,7 @@ class Vehicles:
                                                             province=cat))
         return result
 
+    @memoized
     def _get_fee_of_primary_stations(self, mode=(1, 16), province='all'):
         '''获取全国，省内，省外，mode对应车型的只要收费站信息
         province: all,in,out分别表示全国，省内，省外
@@ -581,12 +1005,13 @@ class Vehicles:
         query = f'(mode>={mode_min})&(mode<={mode_max})&\
 (province>={province_min})&(province<={province_max})'
         # print(query)
-        df = self.frame.query(query)[['station', 'fee']]
+        df = self._cube.query(query)[['station', 'fee']]
         # 获取省份范围内的所有收费站数量
         total_count = df['station'].nunique()
         # 获取分组百分比，并取得主要数据
-        df = self._get_fee_by_group(df, 'station')
-        df = self.get_primary_rows(df, pct=60, max_len=30)
+        df = self._get_fee_by_group(df, 'station', fen=True)
+        df = self.get_primary_rows(df, pct=60, max_len=30,
+                                   by='fen').drop(columns='fen')
         # decode收费站名称如果是省内，去除'四川'
         df['station'] = df['station'].map(
             lambda x: x[2:] if province == 'in' else x)
@@ -594,7 +1019,7 @@ class Vehicles:
         fig_path = fp(
             f'fee_of_primary_stations_{province}_{mode_min}_{mode_max}.png').as_image_file
 
-        Draw(df, fig_path).for_primary()
+        fig_path = self._figure('for_primary', df, fig_path)
 
         return{'cat': cat,
                'total_count': total_count,
@@ -606,6 +1031,7 @@ class Vehicles:
                }
 
     @ property
+    @ memoized
     def fee_of_primary_modes_details(self):
         result = []
         for mode in self._primary_modes:
@@ -622,16 +1048,17 @@ class Vehicles:
         return result
 
     @ property
+    @ memoized
     def fee_of_topmost_plates_of_primary_modes(self):
         result = []
         for mode in self._primary_modes:
             # 获取并过滤数据
-            df = self.frame[self.frame['mode'] == mode]
+            df = self._plate_cube[self._plate_cube['mode'] == mode]
             df = self._get_topmost_plates(df)
             detail = {}
             # 输出数据
             fig_path = fp(f'topmost_plates_{mode}.png').as_image_file
-            Draw(df, fig_path).for_topmost_plates()
+            fig_path = self._figure('for_topmost_plates', df, fig_path)
 
             detail['mode'] = self.decode_mode(mode, simplified=False)
             detail['fee'] = D(df['fee']).sum(scale=False)
@@ -644,11 +1071,12 @@ class Vehicles:
         return result
 
     @ property
+    @ memoized
     def fee_of_topmost_plates(self):
-        df = self._get_topmost_plates(self.frame)
+        df = self._get_topmost_plates(self._plate_cube)
         # 输出数据
         fig_path = fp('topmost_plates.png').as_image_file
-        Draw(df, fig_path).for_topmost_plates()
+        fig_path = self._figure('for_topmost_plates', df, fig_path)
 
         return {'fee': D(df['fee']).sum(scale=False),
                 'per': D(df['per']).sum(),
@@ -658,62 +1086,174 @@ class Vehicles:
 
     def _get_topmost_plates(self, frame):
         '''获取frame中排名靠前的车牌
+        frame:_plate_cube或其中部分车型的行
         返回dataFrame对象，并添加车牌下行次数的列
         '''
+        # 通行费和下行次数在同一次分组中获取
         df = self._get_fee_by_group(frame, 'plate',
                                     scale_fee=False,
-                                    normalize_per=False)
+                                    count=True)
         # 过滤数据
         df = df[~df['plate'].str.startswith(('默', 'WP'))]
 
-        # 排序并截取数据
-        df = df.sort_values(by='fee', ascending=False)
-        df = df.iloc[:self.topmost_plates_count]
-
-        # 添加下行次数
-        df['count'] = df['plate'].map(
-            lambda p: frame[frame['plate'] == p].shape[0])
-
-        return df
+        # 只选取通行费最多的前几个，无需全部排序，见select_top
+        positions = self.select_top(df['fee'].to_numpy(),
+                                    self.topmost_plates_count)
+        return df.iloc[positions]
 
     @property
     def primary_modes(self):
         modes = []
-        for m in self._get_primary_modes():
+        for m in self._primary_modes:
             modes.append(self.decode_mode(m, simplified=False))
         return modes
 
+    @property
+    def primary_mode_threhold(self):
+        '主要车型通行费占比判别值，修改后重新获取主要车型，并清除报告数据缓存'
+        return self._primary_mode_threhold
+
+    @primary_mode_threhold.setter
+    def primary_mode_threhold(self, value):
+        self._primary_mode_threhold = value
+        self._primary_modes = self._get_primary_modes()
+        self.invalidate()
+
+    @property
+    def topmost_plates_count(self):
+        '靠前车牌数量，修改后清除报告数据缓存'
+        return self._topmost_plates_count
+
+    @topmost_plates_count.setter
+    def topmost_plates_count(self, value):
+        self._topmost_plates_count = value
+        self.invalidate()
+
+    def invalidate(self):
+        '''清除报告数据缓存和已绘制图片的记录
+        之后再获取报告数据时重新计算并绘图
+        '''
+        self._memo.clear()
+        self.figures.clear()
+
+    def _figure(self, kind, df, fig_path):
+        '''绘制图片，kind为Draw的方法名，如'for_primary'
+        fig_path:不含哈希值的图片路径
+        图片按内容缓存，数据未改变时不重新绘制，见draw.Renderer.submit
+        返回实际的图片路径（含哈希值），记录在figures中
+        render为False时只记录，不绘制
+        '''
+        if self.render:
+            cached_path = self.renderer.submit(kind, df, fig_path)
+        else:
+            cached_path = self.renderer.path(kind, df, fig_path)
+        self.figures[cached_path] = (kind, df, fig_path)
+        return cached_path
+
+    @property
+    def render_profile(self):
+        '图片输出配置，修改后图片路径改变，清除报告数据缓存'
+        return self.renderer.profile
+
+    @render_profile.setter
+    def render_profile(self, value):
+        if value != self.renderer.profile:
+            self.renderer.profile = value
+            self.invalidate()
+
+    def redraw(self):
+        '强制重新绘制figures中的图片，不重新计算数据，如修改绘图样式后'
+        for kind, df, fig_path in self.figures.values():
+            self.renderer.submit(kind, df, fig_path, force=True)
+
+    def wait_figures(self):
+        '''等待所有已提交的图片绘制完成，返回图片路径list
+        之后清理图片缓存，保留本报告的图片，见cache.ImageCache.evict
+        '''
+        paths = self.renderer.wait()
+        self.renderer.cache.evict(keep=self.figures)
+        return paths
+
     def _get_primary_modes(self):
         '''获取主要车型，返回主要车型编号的list
         '''
-        df = self._get_fee_by_group(self.frame, 'mode')
+        df = self._get_fee_by_group(self._cube, 'mode')
         df = df[df['per'] >= self.primary_mode_threhold]
         series = df.sort_values(by='per', ascending=False)[
             'mode']
         return list(series.to_dict().values())
 
     def _get_fee_by_group(self, frame, by, scale_fee=True,
-                          normalize_per=True):
+                          normalize_per=True, total_fee=None, count=False,
+                          fen=False):
         '''获取不同分组中，各组通行费和组内总占比
 单组返回数据类型：dataFrame
-normalize_per:当数据条数过多时，如按车牌获取，
-计算百分比过程中会使用四舍五入，normalize后误差会很大。
-大多数情况不会出现，所以默认为True
+by:分组的列名，或与frame行对齐、有名称的Series（如布尔值分组）
+normalize_per:各组per之和是否调整为总占比（四舍五入后），见normalize_per
+             total_fee为各组总和时即为100，组数很多（如按车牌）时仍精确
 scale_fee:同样，数据量很大时，缩小10000倍后无意义，因为每个值就很小
+total_fee:计算占比的总通行费（分），默认为frame中的通行费总和
+count:是否添加count列，即各组行数（如车牌的下行次数）
+      frame为聚合数据时，为各组count列的总和
+fen:是否添加fen列，即各组通行费总和（分），用于精确排序，见get_primary_rows
+
+fee列为分，一次groupby求出各组总和，fee和per均由各组总和向量化计算
 '''
-        df = frame[[by, 'fee']]
-        total_fee = D(df['fee']).sum()
-        result = df.groupby(by, as_index=False).agg(
-            fee=('fee', lambda x: D(x).sum(scale=scale_fee, rounding=True)),
-            per=('fee', lambda x: D(x).per(total_fee)))
+        key = frame[by] if isinstance(by, str) else by
+        # category类型的分组键在observed=True时不一定按类别排序，统一用sort_index排序
+        if count and 'count' in frame.columns:
+            values = frame[['fee', 'count']]
+        elif count:
+            values = frame[['fee']].assign(count=1)
+        else:
+            values = frame[['fee']]
+        aggregated = values.groupby(key, sort=True, observed=True).sum()
+        aggregated = aggregated.sort_index()
+        sums = aggregated['fee']
+        fens = sums.to_numpy()
+        if total_fee is None:
+            total_fee = int(fens.sum())
         if normalize_per:
-            result['per'] = self.normalize_per(result['per'])
+            per = self.normalize_per(fens, total_fee)
+        else:
+            per = D.fen_per(fens, total_fee)
+        result = pd.DataFrame({
+            key.name: sums.index.to_numpy(),
+            'fee': D.fen_to_float(fens, scale=scale_fee, rounding=True),
+            'per': per})
+        if count:
+            result['count'] = aggregated['count'].to_numpy()
+        if fen:
+            result['fen'] = fens
 
         return result
 
+    def memory_report(self):
+        '''self.frame各列的内存占用，单位字节
+        before:LEGACY_SCHEMA中的类型，即压缩前车牌，收费站为str对象，通行费为字符串
+        after:当前SCHEMA中的类型
+        返回DataFrame，index为列名和'合计'，列为before, after, ratio(after/before)
+        before需逐列转换数据，数据量大时较慢
+        '''
+        frame = self.frame
+        before, after = {}, {}
+        for col in frame.columns:
+            series = frame[col]
+            after[col] = series.memory_usage(deep=True, index=False)
+            if col == 'fee':
+                legacy = (series / D.FEN).astype(str)
+            else:
+                legacy = series.astype(self.LEGACY_SCHEMA[col])
+            before[col] = legacy.memory_usage(deep=True, index=False)
+        report = pd.DataFrame({'before': before, 'after': after})
+        report.loc['合计'] = report.sum()
+        report['ratio'] = (report['after'] / report['before']).round(3)
+        return report
+
     def show(self):
         # print(self.frame.head(30))
         print(self.frame.info())
+        print(self.memory_report())
         print(self.frame.describe())
         print(self.frame)
 